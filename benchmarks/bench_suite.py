@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the cni_challenge rotation, I/O and evaluation code.
+
+All inputs are synthetic and generated locally, so the suite runs offline.
+
+    # time everything and save the results
+    python benchmarks/bench_suite.py run -o results.json
+
+    # store a baseline, then flag anything more than 20% slower than it
+    python benchmarks/bench_suite.py run -o benchmarks/baseline.json
+    python benchmarks/bench_suite.py compare benchmarks/baseline.json results.json --threshold 0.2
+
+Results are stored as JSON: {"meta": {...}, "results": {"<group>/<case>/<size>": seconds}}, where seconds is the
+best of --repeat runs. compare exits with status 1 if any case regressed.
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SELFPATH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SELFPATH)
+
+if __name__ == '__main__' and ROOT not in sys.path:
+    # run as a script from a checkout: make the cni_challenge package importable
+    sys.path.insert(0, ROOT)
+
+from cni_challenge.example_python import eddy_params, rotate, vector_io
+from cni_challenge.evaluation import classification_metrics
+
+DEFAULT_SIZES = [10 ** p for p in range(3, 8)]
+DEFAULT_IO_MAX = 10 ** 6
+
+# Benchmark groups, registered with @benchmark. Each is called as func(size, workdir, repeat) and returns a
+# dict of {case: seconds}.
+BENCHMARKS = []
+
+
+def benchmark(name, io=False):
+    def register(func):
+        BENCHMARKS.append((name, io, func))
+        return func
+    return register
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_inputs(size, seed=0):
+    """
+    Return (params, bvecs): (size, 16) eddy parameters with small rotations and (size, 3) unit vectors.
+    """
+    rng = np.random.RandomState(seed)
+    params = np.zeros((size, 16))
+    params[:, :3] = rng.normal(scale=0.5, size=(size, 3))
+    params[:, 3:6] = rng.normal(scale=0.01, size=(size, 3))
+    bvecs = rng.normal(size=(size, 3))
+    bvecs /= np.linalg.norm(bvecs, axis=1)[:, np.newaxis]
+    return params, bvecs
+
+
+def synthetic_labels(size, seed=0):
+    """
+    Return (scores, est, gt) for a noisy binary classifier.
+    """
+    rng = np.random.RandomState(seed)
+    gt = rng.randint(0, 2, size)
+    scores = np.clip(0.3 * gt + rng.uniform(size=size) * 0.7, 0, 1)
+    return scores, (scores > 0.5).astype(int), gt
+
+
+@benchmark('rotate')
+def bench_rotate(size, workdir, repeat):
+    params, bvecs = synthetic_inputs(size)
+    rots = params[:, 3:6]
+    bvecs32 = bvecs.astype(np.float32)
+    out32 = np.empty_like(bvecs32)
+    return {
+        'numpy': best_time(lambda: rotate.rotate_vectors(rots, bvecs), repeat),
+        'numpy_float32': best_time(lambda: rotate.rotate_vectors(rots, bvecs32, out=out32), repeat),
+    }
+
+
+@benchmark('rotate_threads')
+def bench_rotate_threads(size, workdir, repeat):
+    # scaling curve of the thread-parallel kernel, from 1 thread up to the CPUs available
+    params, bvecs = synthetic_inputs(size)
+    rots = params[:, 3:6]
+    out = np.empty_like(bvecs)
+    counts = sorted(set([1, 2, 4, 8, 16, 32, rotate.default_workers()]))
+    return dict(('threads_%02d' % n, best_time(lambda: rotate.rotate_vectors_parallel(rots, bvecs, out, n), repeat))
+                for n in counts if n <= rotate.default_workers())
+
+
+@benchmark('rotate_matrix', io=True)
+def bench_rotate_matrix(size, workdir, repeat):
+    params, bvecs = synthetic_inputs(size)
+    results = {}
+    for fmt in ('text', 'npy'):
+        rot_file = os.path.join(workdir, 'rotation_matrices' + vector_io.EXTENSIONS[fmt])
+        vec_file = os.path.join(workdir, 'vectors' + vector_io.EXTENSIONS[fmt])
+        out_file = os.path.join(workdir, 'classification' + vector_io.EXTENSIONS[fmt])
+        vector_io.save_array(rot_file, params, fmt)
+        vector_io.save_array(vec_file, bvecs, fmt)
+        results[fmt] = best_time(lambda: rotate.rotate_matrix(rot_file, vec_file, out_file, out_format=fmt), repeat)
+    return results
+
+
+@benchmark('io', io=True)
+def bench_io(size, workdir, repeat):
+    params, bvecs = synthetic_inputs(size)
+    rot_file = os.path.join(workdir, 'rotation_matrices.txt')
+    vec_file = os.path.join(workdir, 'vectors.txt')
+    out_file = os.path.join(workdir, 'classification.txt')
+    vector_io.save_array(rot_file, params)
+    vector_io.save_array(vec_file, bvecs)
+    return {
+        'load_rotations_text': best_time(lambda: eddy_params.parse_rotations(rot_file), repeat),
+        'load_rotations_loadtxt': best_time(lambda: np.loadtxt(rot_file)[:, eddy_params.ROTATION_COLUMNS], repeat),
+        'load_vectors_text': best_time(lambda: vector_io.load_array(vec_file), repeat),
+        'save_text': best_time(lambda: vector_io.save_array(out_file, bvecs), repeat),
+    }
+
+
+@benchmark('metrics')
+def bench_metrics(size, workdir, repeat):
+    scores, est, gt = synthetic_labels(size)
+    return {
+        'get_metrics': best_time(lambda: classification_metrics.get_metrics(est, gt), repeat),
+        'get_AUC': best_time(lambda: classification_metrics.get_AUC(scores, gt), repeat),
+    }
+
+
+def read_file_csv(filename, dtype=int):
+    # the previous classification_metrics.read_file: one Python object per row
+    data = []
+    with open(filename, 'r') as fid:
+        for row in csv.reader(fid):
+            data.append(dtype(row[0]))
+    return np.asarray(data)
+
+
+@benchmark('read_file', io=True)
+def bench_read_file(size, workdir, repeat):
+    scores, est, gt = synthetic_labels(size)
+    labels_file = os.path.join(workdir, 'labels.csv')
+    scores_file = os.path.join(workdir, 'scores.csv')
+    np.savetxt(labels_file, est, fmt='%d')
+    np.savetxt(scores_file, scores, fmt='%.6f')
+    with open(labels_file, 'rb') as fid, gzip.open(labels_file + '.gz', 'wb', compresslevel=1) as out:
+        shutil.copyfileobj(fid, out)
+    return {
+        'labels_csv_reader': best_time(lambda: read_file_csv(labels_file), repeat),
+        'labels_bulk': best_time(lambda: classification_metrics.read_file(labels_file), repeat),
+        'labels_bulk_gzip': best_time(lambda: classification_metrics.read_file(labels_file + '.gz'), repeat),
+        'scores_csv_reader': best_time(lambda: read_file_csv(scores_file, float), repeat),
+        'scores_bulk': best_time(lambda: classification_metrics.read_file(scores_file, float), repeat),
+    }
+
+
+def run(sizes, io_max, repeat, only=None):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='cni_bench_')
+    try:
+        for name, io, func in BENCHMARKS:
+            if only and name not in only:
+                continue
+            for size in sizes:
+                if io and size > io_max:
+                    continue
+                for case, seconds in sorted(func(size, workdir, repeat).items()):
+                    key = '%s/%s/%d' % (name, case, size)
+                    results[key] = seconds
+                    print('%-45s %10.4f s %14.0f rows/s' % (key, seconds, size / seconds if seconds else 0))
+    finally:
+        shutil.rmtree(workdir)
+    meta = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current, threshold):
+    """
+    Return the (key, baseline seconds, current seconds) of every case more than threshold slower than baseline.
+    """
+    regressions = []
+    for key, seconds in sorted(current['results'].items()):
+        base = baseline['results'].get(key)
+        if base is not None and seconds > base * (1 + threshold):
+            regressions.append((key, base, seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', help='JSON file to save results to')
+    run_parser.add_argument('--sizes', type=lambda s: [int(float(v)) for v in s.split(',')], default=DEFAULT_SIZES,
+                            help='comma separated problem sizes (default 1e3,...,1e7)')
+    run_parser.add_argument('--io-max', type=lambda s: int(float(s)), default=DEFAULT_IO_MAX,
+                            help='largest size for benchmarks that go through files (default 1e6)')
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs per case; the best is kept (default 3)')
+    run_parser.add_argument('--only', nargs='+', help='benchmark groups to run (default all)')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline', help='baseline results JSON')
+    compare_parser.add_argument('current', help='current results JSON')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='allowed slowdown as a fraction of the baseline (default 0.2)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.sizes, args.io_max, args.repeat, args.only)
+        if args.output:
+            with open(args.output, 'w') as fid:
+                json.dump(results, fid, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.baseline) as fid:
+        baseline = json.load(fid)
+    with open(args.current) as fid:
+        current = json.load(fid)
+    regressions = compare(baseline, current, args.threshold)
+    for key, base, seconds in regressions:
+        print('REGRESSION %-45s %10.4f s -> %10.4f s (%+.0f%%)' % (key, base, seconds, 100 * (seconds / base - 1)))
+    print('%d regression(s) in %d cases' % (len(regressions), len(current['results'])))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,14 +10,18 @@
 #
 
 
+import json
 import os
 import sys
+import time
 sys.path.append(os.path.dirname(__file__))
 
 # import the Chris app superclass
 from chrisapp.base import ChrisApp
-# Import a python function that performs a matrix rotation
-from example_python.rotate import rotate_matrix
+from instrumentation import StageTimer
+from manifest import Manifest, code_version
+# NumPy-based modules (example_python, example_C) are imported in the functions that use them, so that
+# metadata commands such as --version, --json and --meta start without loading them.
 
 Gstr_title = """
 
@@ -51,6 +55,16 @@ Gstr_synopsis = """
             <inputDir>                                                  \\
             <outputDir>                                                 \\
             [--rot <matrix_file.txt>]                                   \\
+            [--chunk_size <N>]                                          \\
+            [--output_format < text || npy || raw >]                    \\
+            [--dtype < float64 || float32 >]                            \\
+            [--cache_dir <DIR>] [--cache_size_mb <N>]                   \\
+            [--workers <N>]                                             \\
+            [--threads <N>]                                             \\
+            [--profile]                                                 \\
+            [--force]                                                   \\
+            [--connectome < correlation || partial || correlation,partial >] \\
+            [--service_socket <PATH>]                                   \\
 
     BRIEF EXAMPLE
 
@@ -84,11 +98,74 @@ Gstr_synopsis = """
         Mandatory. A directory where output will be saved to. Must be universally writable to.
         
         [--run_option < python || C >]
-        Mandatory for bare bones example. C example still to come!
+        Mandatory for bare bones example. 'python' rotates with NumPy; 'C' rotates the same inputs with the
+        native batch kernel in example_C/rotate.cpp (built with 'make -C example_C', or on first use).
         
         [--rot <matrix_file.txt>]
         Mandatory for bare bones example. String of file containing rotation matrices.
 
+        [--chunk_size <N>]
+        Optional. If greater than 0, stream the rotation and vector files N rows at a time
+        so that memory use is bounded by N rather than by the input size. Default 0 (read whole files).
+
+        [--output_format < text || npy || raw >]
+        Optional. Format of the rotated vectors: tab separated text (classification.txt, default),
+        NumPy .npy (classification.npy) or raw little-endian binary with a 16 byte header (classification.bin).
+        The vectors (vectors.txt, vectors.npy or vectors.bin) and rotation files may be in any of these
+        formats; it is detected from the file contents and binary inputs are memory-mapped.
+
+        [--dtype < float64 || float32 >]
+        Optional. Precision of the rotation. float32 parses text vectors, rotates them and stores npy/raw
+        outputs in single precision, halving memory traffic; results agree with float64 to a few 1e-7 for
+        unit vectors, the last digit of the text output. Default float64.
+
+        [--cache_dir <DIR>]
+        Optional. Directory in which to cache the parsed rotations of text eddy parameter files, keyed by
+        file path, size and modification time, so that repeat runs skip parsing. Default '' (no cache).
+
+        [--cache_size_mb <N>]
+        Optional. Maximum total size of --cache_dir; least recently used entries are evicted. Default 512.
+
+        [--workers <N>]
+        Optional. If <inputDir> holds per-subject subdirectories (each with its own vectors and rotation files)
+        instead of a vectors file, all subjects are processed on a pool of N processes, writing to
+        <outputDir>/<subject>/. A failing subject is reported without stopping the others. Default 1.
+
+        [--threads <N>]
+        Optional. Number of threads rotating blocks of each subject's vectors in parallel, into one output in
+        the original order. Default 0: the CPUs available to the plugin (affinity mask, cgroup quota and
+        MAX_CPU_LIMIT), shared between the --workers processes.
+
+        [--profile]
+        Optional. Also write a cProfile dump of the run to <outputDir>/profile.prof.
+
+        [--force]
+        Optional. Recompute even if <outputDir>/manifest.json shows the output is up to date. Each run records
+        there the content hashes (SHA-256) of its input files, the options that affect the output and the code
+        version; a later run with all of these unchanged, and the output untouched, skips the rotation. In batch
+        mode each subject has its own manifest, so only subjects whose inputs changed are recomputed.
+
+        [--connectome < correlation || partial || correlation,partial >]
+        Optional. Extract connectome features from per-subject ROI time series: each subdirectory of <inputDir>
+        (or <inputDir> itself) holding timeseries.txt (or .npy/.bin), nTimepoints x nROIs. Correlation and/or
+        partial-correlation matrices are computed for all subjects in batched matrix operations and their upper
+        triangles saved as float32 feature matrices <outputDir>/connectome_<kind>.npy, one row per subject
+        listed in <outputDir>/connectome_subjects.txt. Each subject's features are cached (in
+        <outputDir>/connectome_cache, or under --cache_dir), so a re-run only computes new or changed subjects.
+        The time series themselves are gathered once into the cohort store <outputDir>/cohort_timeseries.bin
+        (one memory-mapped array, with the subject index cohort_timeseries.idx), which later runs only append
+        new or changed subjects to.
+        The rotation example runs afterwards only if <inputDir> also holds vectors. Default '' (no features).
+
+        [--service_socket <PATH>]
+        Optional. Unix domain socket of a running worker service (python service.py --socket <PATH>), which
+        keeps the plugin's modules loaded between runs. If a service answers there, the rotations are run by it;
+        otherwise they run in this process. Default '' (no service).
+
+        Every run writes <outputDir>/run_stats.json with the wall time, CPU time, memory (the process
+        peak RSS so far, and how much each stage raised it) and rows/second of the load, compute and save stages
+        (per subject in batch mode).
+
         [-h] [--help]
         If specified, show help message and exit.
         
@@ -112,6 +189,253 @@ Gstr_synopsis = """
 
 """
 
+# Input and output file names, relative to 'inputdir' and 'outputdir' (or to a subject's subdirectory of each)
+INPUT_DATA_NAMES = ('vectors.txt', 'vectors.npy', 'vectors.bin')   # Text file of vectors, or its binary equivalent
+OUTPUT_CLASSIFICATION_NAME = 'classification'                     # Output file of rotated vectors, extension by format
+OUTPUT_SCORES_NAME = 'scores.txt'                                 # Example expected output text file of Challenge
+                                                                  # prediction/probability score
+OUTPUT_STATS_NAME = 'run_stats.json'                              # Per-stage timing and resource statistics
+OUTPUT_PROFILE_NAME = 'profile.prof'                              # cProfile dump, written with --profile
+OUTPUT_MANIFEST_NAME = 'manifest.json'                            # Inputs, options and code of the last run
+OUTPUT_CONNECTOME_NAME = 'connectome_%s.npy'                      # Connectome feature matrix, per kind
+OUTPUT_CONNECTOME_SUBJECTS_NAME = 'connectome_subjects.txt'       # Subject of each connectome feature row
+OUTPUT_CONNECTOME_CACHE_NAME = 'connectome_cache'                 # Per-subject connectome features
+OUTPUT_COHORT_NAME = 'cohort_timeseries'                          # Cohort store of all subjects' time series
+
+# Options that change the output, recorded in OUTPUT_MANIFEST_NAME (--chunk_size, --threads etc. only change speed)
+MANIFEST_OPTIONS = ('rot', 'run_option', 'output_format', 'dtype')
+
+# Sources that compute the output, hashed into the code version of OUTPUT_MANIFEST_NAME
+CODE_SOURCES = ('example_python/rotate.py', 'example_python/eddy_params.py', 'example_python/vector_io.py',
+                'example_C/rotate.cpp')
+
+# Options holding paths, made absolute before a job is sent to the worker service, which has its own working directory
+PATH_OPTIONS = ('inputdir', 'outputdir', 'cache_dir', 'service_socket')
+
+# Accepted values of --run_option and --dtype
+RUN_OPTIONS = ('python', 'C')
+DTYPES = ('float64', 'float32')
+
+
+def get_kernel(run_option):
+    """
+    Return the rotation kernel for run_option: the NumPy engine or the native (C++) batch kernel.
+    """
+    if run_option == 'C':
+        from example_C.rotate import load_library, rotate_vectors
+        load_library()      # build and load once, before any thread or process pool uses the kernel
+    else:
+        from example_python.rotate import rotate_vectors
+    return rotate_vectors
+
+
+def find_input_data(inputdir):
+    """
+    Return the path of the vectors file in inputdir, or None if there is none.
+    """
+    for name in INPUT_DATA_NAMES:
+        str_vectors = '%s/%s' % (inputdir, name)
+        if os.path.exists(str_vectors):
+            return str_vectors
+    return None
+
+
+def find_subjects(inputdir):
+    """
+    Return the sorted names of the per-subject subdirectories of inputdir that contain a vectors file.
+    """
+    subjects = []
+    for name in sorted(os.listdir(inputdir)):
+        subject_dir = '%s/%s' % (inputdir, name)
+        if os.path.isdir(subject_dir) and find_input_data(subject_dir) is not None:
+            subjects.append(name)
+    return subjects
+
+
+def find_timeseries_subjects(inputdir):
+    """
+    Return [(subject, time series file)] for inputdir: each subdirectory with a time series file, in sorted order,
+    or inputdir itself (named after it) if it holds one.
+    """
+    from example_python.connectome import find_timeseries
+    filename = find_timeseries(inputdir)
+    if filename is not None:
+        return [(os.path.basename(os.path.abspath(inputdir)), filename)]
+    subjects = []
+    for name in sorted(os.listdir(inputdir)):
+        filename = find_timeseries('%s/%s' % (inputdir, name))
+        if filename is not None:
+            subjects.append((name, filename))
+    return subjects
+
+
+def get_connectome_kinds(options):
+    """
+    Return the connectome kinds listed, comma separated, in options.connectome.
+    """
+    return [kind.strip() for kind in options.connectome.split(',') if kind.strip()]
+
+
+def extract_connectomes(options):
+    """
+    Compute the --connectome features of every subject in options.inputdir and save them to options.outputdir.
+    The time series are first gathered into the cohort store OUTPUT_COHORT_NAME in options.outputdir (only new or
+    changed subjects are read from inputdir) and read back from its memory map. Returns the subjects and
+    {kind: feature matrix}.
+    """
+    from example_python.cohort_store import CohortStore
+    from example_python.connectome import extract_features
+    from example_python.vector_io import save_array
+
+    kinds = get_connectome_kinds(options)
+    subjects = find_timeseries_subjects(options.inputdir)
+    os.makedirs(options.outputdir, exist_ok=True)
+    if options.cache_dir:
+        cache_dir = '%s/%s' % (options.cache_dir, OUTPUT_CONNECTOME_CACHE_NAME)
+    else:
+        cache_dir = '%s/%s' % (options.outputdir, OUTPUT_CONNECTOME_CACHE_NAME)
+
+    store = CohortStore('%s/%s' % (options.outputdir, OUTPUT_COHORT_NAME))
+    store.update_from_files(subjects)
+    subject_of = dict((filename, subject) for subject, filename in subjects)
+    features = extract_features([filename for _, filename in subjects], kinds, cache_dir,
+                                load=lambda filename: store[subject_of[filename]])
+    for kind, matrix in features.items():
+        save_array('%s/%s' % (options.outputdir, OUTPUT_CONNECTOME_NAME % kind), matrix, 'npy')
+    with open('%s/%s' % (options.outputdir, OUTPUT_CONNECTOME_SUBJECTS_NAME), 'w') as fid:
+        fid.writelines('%s\n' % subject for subject, _ in subjects)
+    return [subject for subject, _ in subjects], features
+
+
+def get_threads(options):
+    """
+    Return the number of rotation threads per subject: options.threads, or if 0 the CPUs this process may use
+    (capped by Cni_challenge.MAX_CPU_LIMIT when set) divided between the options.workers processes.
+    """
+    if options.threads > 0:
+        return options.threads
+    from example_python.rotate import default_workers
+    cpus = default_workers()
+    if Cni_challenge.MAX_CPU_LIMIT:
+        cpus = min(cpus, max(1, int(Cni_challenge.MAX_CPU_LIMIT.rstrip('m')) // 1000))
+    return max(1, cpus // max(1, options.workers))
+
+
+def rotate_subject(inputdir, outputdir, options):
+    """
+    Rotate the vectors of a single subject from inputdir into outputdir, writing the load/compute/save statistics
+    to OUTPUT_STATS_NAME (and a cProfile dump to OUTPUT_PROFILE_NAME with --profile) in outputdir.
+    Returns the output file and the statistics.
+
+    The run is skipped, returning the statistics of the run that wrote the output with 'skipped' set, if
+    OUTPUT_MANIFEST_NAME shows the output was computed from the same inputs, options and code (unless --force).
+    """
+    # Import a python function that performs a matrix rotation
+    from example_python.rotate import rotate_matrix
+    from example_python.vector_io import EXTENSIONS
+    from example_python.eddy_params import RotationCache
+
+    str_rotation_matrix = '%s/%s' % (inputdir, options.rot)       # File containing rotation matrices
+    str_vectors = find_input_data(inputdir) or '%s/%s' % (inputdir, INPUT_DATA_NAMES[0])
+    out_str = '%s/%s%s' % (outputdir, OUTPUT_CLASSIFICATION_NAME, EXTENSIONS[options.output_format])
+    os.makedirs(outputdir, exist_ok=True)
+
+    selfpath = os.path.dirname(os.path.abspath(__file__))
+    manifest = Manifest('%s/%s' % (outputdir, OUTPUT_MANIFEST_NAME),
+                        inputs={'rotations': str_rotation_matrix, 'vectors': str_vectors},
+                        options=dict((name, getattr(options, name)) for name in MANIFEST_OPTIONS),
+                        version=code_version(Cni_challenge.VERSION,
+                                             [os.path.join(selfpath, source) for source in CODE_SOURCES]))
+    outputs = {'classification': out_str}
+    if not getattr(options, 'force', False) and manifest.up_to_date(outputs):
+        try:
+            with open('%s/%s' % (outputdir, OUTPUT_STATS_NAME)) as fid:
+                stats = json.load(fid)
+        except (OSError, ValueError):
+            stats = {}
+        stats['skipped'] = True
+        return out_str, stats
+    manifest.invalidate()
+
+    rot_cache = None
+    if options.cache_dir:
+        rot_cache = RotationCache(options.cache_dir, max_bytes=options.cache_size_mb * 1024 * 1024)
+
+    profiler = None
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    threads = get_threads(options)
+    stages = StageTimer()
+    try:
+        rotate_matrix(str_rotation_matrix, str_vectors, out_str, chunk_size=options.chunk_size,
+                      out_format=options.output_format, rot_cache=rot_cache, kernel=get_kernel(options.run_option),
+                      stages=stages, dtype=options.dtype, threads=threads)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats('%s/%s' % (outputdir, OUTPUT_PROFILE_NAME))
+
+    stats = stages.save('%s/%s' % (outputdir, OUTPUT_STATS_NAME), run_option=options.run_option,
+                        output=os.path.basename(out_str), threads=threads)
+    manifest.save(outputs)
+    return out_str, stats
+
+
+def rotate_subject_service(inputdir, outputdir, options):
+    """
+    As rotate_subject, but run by the worker service listening on options.service_socket.
+    """
+    from service import request
+    jobOptions = dict(vars(options))
+    for name in PATH_OPTIONS:
+        if jobOptions.get(name):
+            jobOptions[name] = os.path.abspath(jobOptions[name])
+    result = request(options.service_socket, 'rotate', inputdir=os.path.abspath(inputdir),
+                     outputdir=os.path.abspath(outputdir), options=jobOptions)
+    return result['output'], result['stats']
+
+
+def get_rotate_job(options):
+    """
+    Return rotate_subject_service if a worker service answers on options.service_socket, else rotate_subject.
+    """
+    if getattr(options, 'service_socket', ''):
+        from service import is_available
+        if is_available(options.service_socket):
+            return rotate_subject_service
+        sys.stderr.write('\tNo service on %s, running in-process\n' % options.service_socket)
+    return rotate_subject
+
+
+def rotate_subjects(subjects, options):
+    """
+    Rotate every subject in 'inputdir/<subject>' into 'outputdir/<subject>' on a pool of options.workers
+    processes. Yields (subject, result, error) as subjects complete, so one failure does not stop the rest.
+    """
+    def paths(subject):
+        return '%s/%s' % (options.inputdir, subject), '%s/%s' % (options.outputdir, subject)
+
+    job = get_rotate_job(options)
+    if options.workers <= 1:
+        for subject in subjects:
+            try:
+                yield subject, job(*paths(subject), options), None
+            except Exception as e:
+                yield subject, None, e
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=options.workers) as pool:
+        futures = {pool.submit(job, *paths(subject), options): subject for subject in subjects}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
 
 class Cni_challenge(ChrisApp):
     """
@@ -151,7 +475,10 @@ class Cni_challenge(ChrisApp):
     # The above dictionary is saved when plugin is called with a ``--saveoutputmeta``
     # flag. Note also that all file paths are relative to the system specified
     # output directory.
-    OUTPUT_META_DICT = {}
+    OUTPUT_META_DICT = {
+        "runStatsFile": OUTPUT_STATS_NAME,
+        "manifestFile": OUTPUT_MANIFEST_NAME,
+    }
 
 
     def define_parameters(self):
@@ -167,6 +494,39 @@ class Cni_challenge(ChrisApp):
         self.add_argument('--run_option', dest='run_option', type=str, optional=False,
                       help='Type string: Define which code to run: python || C')
 
+        self.add_argument('--chunk_size', dest='chunk_size', type=int, optional=True, default=0,
+                          help='Type int: Number of rows to stream per chunk (0 reads whole files)')
+
+        self.add_argument('--output_format', dest='output_format', type=str, optional=True, default='text',
+                          help='Type string: Format of the rotated vectors: text || npy || raw')
+
+        self.add_argument('--dtype', dest='dtype', type=str, optional=True, default='float64',
+                          help='Type string: Precision of the rotation: float64 || float32')
+
+        self.add_argument('--cache_dir', dest='cache_dir', type=str, optional=True, default='',
+                          help='Type string: Directory for the parsed rotation cache (empty disables it)')
+
+        self.add_argument('--cache_size_mb', dest='cache_size_mb', type=int, optional=True, default=512,
+                          help='Type int: Maximum size of the parsed rotation cache in MB')
+
+        self.add_argument('--workers', dest='workers', type=int, optional=True, default=1,
+                          help='Type int: Number of processes used to rotate per-subject subdirectories')
+
+        self.add_argument('--threads', dest='threads', type=int, optional=True, default=0,
+                          help='Type int: Threads rotating each subject (0 uses the available CPUs)')
+
+        self.add_argument('--profile', dest='profile', type=bool, optional=True, default=False,
+                          help='Type bool: Write a cProfile dump of the run to outputdir')
+
+        self.add_argument('--force', dest='force', type=bool, optional=True, default=False,
+                          help='Type bool: Recompute even if the manifest shows the output is up to date')
+
+        self.add_argument('--connectome', dest='connectome', type=str, optional=True, default='',
+                          help='Type string: Connectome features to extract: correlation || partial, comma separated')
+
+        self.add_argument('--service_socket', dest='service_socket', type=str, optional=True, default='',
+                          help='Type string: Unix socket of a running worker service to send jobs to')
+
 
     def run(self, options):
         """
@@ -176,46 +536,87 @@ class Cni_challenge(ChrisApp):
         print(Gstr_title)
         print('Version: %s' % self.get_version())
 
-        # ===============================================
-        # Initialising variables
-        # ===============================================
-        input_data_name = 'vectors.txt'                                     # Text file of vectors
-        output_classification_name = 'classification.txt'                   # Output text file of rotated vectors
-        output_scores_name = 'scores.txt'                                   # Example expected output text file of Challenge 
-                                                                            # prediction/probability score
-
-        # Input and output files must be in 'inputdir' and 'outputdir', respectively.
-        str_rotation_matrix = '%s/%s' % (options.inputdir, options.rot)     # File containing rotation matrices
-        str_vectors = '%s/%s' % (options.inputdir, input_data_name)
-        out_str= '%s/%s' % (options.outputdir, output_classification_name)
-        out_str_scores= '%s/%s' % (options.outputdir, output_scores_name)   # Include this as part of your output. See 
-                                                                            # 'rotate_matrix' function call below for an example.
-
-        # ===============================================
-        # Call code
-        # ===============================================
-        if (options.run_option == 'python'):
+        if options.run_option not in RUN_OPTIONS:
 
-            # Call python module
             print("\n")
-            print("\tCalling python code to perform vector rotations...")
-            rotate_matrix(str_rotation_matrix, str_vectors, out_str)
-            print ("\tOutput will be in %s" % out_str)
+            sys.stderr.write('\tUnrecognised --run_option encountered. Note input is case-sensitive\n')
             print("====================================================================================")
+            print(Gstr_synopsis)
+            sys.exit()
 
-        elif (options.run_option == 'C'):
+        if options.dtype not in DTYPES:
+            sys.stderr.write('\tUnrecognised --dtype %s, expected one of %s\n' % (options.dtype, ', '.join(DTYPES)))
+            sys.exit(1)
 
-            # Call C example
-            print("\n")
-            print("\tC example to come....\n")
-            print("====================================================================================")
-        else:
+        from example_python.vector_io import EXTENSIONS
+        if options.output_format not in EXTENSIONS:
+            sys.stderr.write('\tUnrecognised --output_format %s, expected one of %s\n'
+                             % (options.output_format, ', '.join(EXTENSIONS)))
+            sys.exit(1)
 
+        from example_python.connectome import CONNECTOME_KINDS
+        unknown = [kind for kind in get_connectome_kinds(options) if kind not in CONNECTOME_KINDS]
+        if unknown:
+            sys.stderr.write('\tUnrecognised --connectome %s, expected a comma separated list of %s\n'
+                             % (', '.join(unknown), ', '.join(CONNECTOME_KINDS)))
+            sys.exit(1)
+
+        # ===============================================
+        # Call code
+        # ===============================================
+        # Input and output files must be in 'inputdir' and 'outputdir', respectively; if 'inputdir' holds no
+        # vectors file itself, each of its subdirectories that does is treated as a subject.
+        # Include scores.txt (OUTPUT_SCORES_NAME) as part of your output. See 'rotate_subject' for an example.
+        if options.connectome:
             print("\n")
-            sys.stderr.write('\tUnrecognised --run_option encountered. Note input is case-sensitive\n')
+            print("\tExtracting %s connectome features..." % options.connectome)
+            start = time.perf_counter()
+            connectome_subjects, features = extract_connectomes(options)
+            print("\t%d subjects took %.3f s, features in %s" % (len(connectome_subjects), time.perf_counter() - start,
+                                                              ', '.join(OUTPUT_CONNECTOME_NAME % kind for kind in features)))
+
+        subjects = [] if find_input_data(options.inputdir) else find_subjects(options.inputdir)
+        if options.connectome and not subjects and find_input_data(options.inputdir) is None:
             print("====================================================================================")
-            print(Gstr_synopsis)
-            sys.exit()
+            return
+
+        print("\n")
+        if not subjects:
+            print("\tCalling %s code to perform vector rotations..." % options.run_option)
+            out_str, stats = get_rotate_job(options)(options.inputdir, options.outputdir, options)
+            if stats.get('skipped'):
+                print("\tInputs, options and code unchanged since the last run, skipped (use --force to recompute)")
+            else:
+                print("\tRotation took %.3f s" % stats['total']['wall_s'])
+            print ("\tOutput will be in %s" % out_str)
+            print("====================================================================================")
+            return
+
+        get_kernel(options.run_option)      # the native library is built once, here, not by every worker
+        print("\tCalling %s code to perform vector rotations for %d subjects with %d worker(s)..." %
+              (options.run_option, len(subjects), options.workers))
+        start = time.perf_counter()
+        failed = []
+        subject_stats = {}
+        for subject, result, error in rotate_subjects(subjects, options):
+            if error is not None:
+                failed.append(subject)
+                sys.stderr.write('\t%s: failed: %s\n' % (subject, error))
+            else:
+                subject_stats[subject] = result[1]
+                if result[1].get('skipped'):
+                    print("\t%s: unchanged, skipped, output in %s" % (subject, result[0]))
+                else:
+                    print("\t%s: rotation took %.3f s, output in %s" % (subject, result[1]['total']['wall_s'], result[0]))
+        print("\t%d of %d subjects completed" % (len(subjects) - len(failed), len(subjects)))
+        if failed:
+            sys.stderr.write('\tFailed subjects: %s\n' % ', '.join(sorted(failed)))
+
+        # Batch statistics: per-subject stages (also in each subject's own OUTPUT_STATS_NAME) and the overall wall time
+        with open('%s/%s' % (options.outputdir, OUTPUT_STATS_NAME), 'w') as fid:
+            json.dump({'wall_s': time.perf_counter() - start, 'workers': options.workers,
+                       'subjects': subject_stats, 'failed': sorted(failed)}, fid, indent=2, sort_keys=True)
+        print("====================================================================================")
 
     def show_man_page(self):
         """
@@ -39,11 +39,13 @@ __version__ = '0.1'
 import sys
 import os
 import numpy as np
-import sklearn.metrics as skm
 import getopt
 import csv
-
-import pdb
+import functools
+import gzip
+import itertools
+import warnings
+from collections import namedtuple
 
 #=============================================
 # Helper functions
@@ -57,15 +59,46 @@ num_p = np.inf
 num_n = np.inf
 
 def help():
-	print("usage: classification_metrics.py -p <prediction_file> -g <groundtruth_file> -o <outputfile>")
+	print("usage: classification_metrics.py -p <prediction_file> -g <groundtruth_file> -o <outputfile> [-s <chunk_rows>]")
+	print("       -s/--stream: score the inputs <chunk_rows> rows at a time instead of loading them whole")
+	print("       -b/--bootstrap <n_boot> [-r/--seed <seed>] [-j/--workers <n>]: add 95% bootstrap confidence interval columns")
+	print("       -t/--sweep <metric>: read probability scores, write metrics at every threshold and report the one maximising <metric>")
+	print("       -k/--multiclass: write per-class, macro and micro metrics (Class,Metric,Value) for any number of labels")
+	print("       -G/--groups <group_file>: write every metric per group (e.g. site) as Group,Metric,Value rows, plus 'all'")
+	print("       -c/--scores <scores_file>: with -G, compute AUC from these probability scores instead of the predictions")
+	print("usage: classification_metrics.py -L <prediction_dir> -g <groundtruth_file> -o <outputfile> [-j <workers>]")
+	print("       -L/--leaderboard: score every prediction file in <prediction_dir>, one Submission row each, on <workers> processes")
 	sys.exit()
 
+ConfusionCounts = namedtuple('ConfusionCounts', ['TP', 'FP', 'TN', 'FN'])
+
+def get_label_index(labels):
+	# 0 and 1 map to themselves; any other label maps to 2 and is counted in none of the confusion cells
+	labels = np.asarray(labels)
+	return np.where((labels == 0) | (labels == 1), labels, 2).astype(np.intp)
+
+def get_index_confusion(est_index, gt_index, n_classes):
+	# KxK confusion matrix (rows: ground truth, columns: estimate) of class indices from one bincount over gt*K+est
+	return np.bincount(n_classes * np.asarray(gt_index) + np.asarray(est_index),
+					   minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+def get_class_counts(cells):
+	# one-vs-rest ConfusionCounts of arrays, one entry per class, from a KxK confusion matrix
+	cells = np.asarray(cells, dtype=np.float64)
+	TP = np.diag(cells)
+	FP = cells.sum(axis=0) - TP
+	FN = cells.sum(axis=1) - TP
+	return ConfusionCounts(TP=TP, FP=FP, TN=cells.sum() - TP - FP - FN, FN=FN)
+
+def get_counts(est, gt):
+	# binary confusion counts: the label 1 row of the (0, 1, other) confusion matrix; "other" labels count nowhere
+	cells = get_index_confusion(get_label_index(est), get_label_index(gt), 3)
+	return ConfusionCounts(TP=float(cells[1, 1]), FP=float(cells[0, 1]), TN=float(cells[0, 0]), FN=float(cells[1, 0]))
+
 def get_confusion_matrix(est, gt):
+	# sets the module globals used by the get_*() helpers below; get_metrics() does not rely on them
 	global TP, FP, TN, FN, num_p, num_n
-	TP = np.float(np.sum(np.logical_and((est==1), (gt==1)).astype(int)))
-	TN = np.float(np.sum(np.logical_and((est==0), (gt==0)).astype(int)))
-	FP = np.float(np.sum(np.logical_and((est==1), (gt==0)).astype(int)))
-	FN = np.float(np.sum(np.logical_and((gt==1), (est==0)).astype(int)))
+	TP, FP, TN, FN = get_counts(est, gt)
 
 def get_tpr():
 	# sensitivity / recall / hit rate/ true positive rate
@@ -163,8 +196,18 @@ def get_dor():
 	return get_plr()/get_nlr()
 
 def get_AUC(est, gt):
-	fpr, tpr, thresholds = skm.roc_curve(gt, est)
-	return skm.auc(fpr, tpr)
+	# rank-based (Mann-Whitney) AUC from a single sort of the scores; tied scores count half
+	levels, level_index = np.unique(np.asarray(est), return_inverse=True)
+	level_index = level_index.ravel()
+	gt = np.asarray(gt).ravel()
+	neg = np.bincount(level_index[gt == 0], minlength=levels.size)
+	pos = np.bincount(level_index[gt == 1], minlength=levels.size)
+	return float(get_AUC_from_histograms(neg, pos))
+
+def get_roc_curve(est, gt):
+	# full ROC curve (fpr, tpr, thresholds); sklearn is only imported when this is asked for
+	import sklearn.metrics as skm
+	return skm.roc_curve(gt, est)
 
 def get_OP():
 	sn = get_tpr()
@@ -172,73 +215,272 @@ def get_OP():
 	P =  sn* (TP+FN) + sp * (TN+FP)
 	return P - np.abs(sp-sn)/(sp + sn)
 
-def get_metrics(est, gt):
-	# set up global variables
-	get_confusion_matrix(est, gt)
-
-	# initialize output
-	results = []
-	names = []
-
-	names.append('Sensitivity')
-	results.append(get_tpr())
-
-	names.append('Specificity')
-	results.append(get_tnr())
-
-	names.append('Precision')
-	results.append(get_ppv())
-
-	names.append('Negative_predictive_value')
-	results.append(get_npv())
-
-	names.append('False_negative_rate')
-	results.append(get_fnr())
-
-	names.append('False_positive_rate')
-	results.append(get_fpr())
-
-	names.append('False_discovery_rate')
-	results.append(get_fdr())
-
-	names.append('False_omission_rate')
-	results.append(get_for())
-
-	names.append('Accuracy')
-	results.append(get_accuracy())
+METRIC_NAMES = ['Sensitivity', 'Specificity', 'Precision', 'Negative_predictive_value', 'False_negative_rate',
+				'False_positive_rate', 'False_discovery_rate', 'False_omission_rate', 'Accuracy', 'F1_score',
+				'Geom_mean', 'Matthews_CC', 'Informedness', 'Markedness', 'Optimized_precision']
 
-	names.append('F1_score')
-	results.append(get_f1_score())
+def ratio(num, den):
+	# num/den, or nan where den is 0
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.where(den == 0, np.nan, num/np.where(den == 0, 1, den))
 
-	names.append('Geom_mean')
-	results.append(get_geom_mean())
+def get_metric_arrays(TP, FP, TN, FN):
+	# every metric of get_metrics() except AUC, in METRIC_NAMES order, element-wise over arrays of counts
+	TP, FP, TN, FN = (np.asarray(c, dtype=np.float64) for c in (TP, FP, TN, FN))
 
-	names.append('Matthews_CC')
-	results.append(get_mcc())
+	tpr = ratio(TP, TP+FN)
+	tnr = ratio(TN, TN+FP)
+	ppv = ratio(TP, TP+FP)
+	npv = ratio(TN, TN+FN)
 
-	names.append('Informedness')
-	results.append(get_bm())
+	with np.errstate(divide='ignore', invalid='ignore'):
+		f1_score = np.where((tpr == 0) | (ppv == 0), np.nan, 1./((1./tpr + 1./ppv)/2.))
+		mcc = ratio(TP*TN - FP * FN, np.sqrt((TP+FP)*(TP+FN)*(TN+FP)*(TN+FN)))
+		P = tpr * (TP+FN) + tnr * (TN+FP)
+		op = P - np.abs(tnr-tpr)/(tnr + tpr)
 
-	names.append('Markedness')
-	results.append(get_markedness())
+	return [tpr, tnr, ppv, npv,
+			ratio(FN, FN+TP), ratio(FP, FP+TN), ratio(FP, FP+TP), ratio(FN, FN+TN), ratio(TP+TN, TP+TN+FP+FN),
+			f1_score, np.sqrt(tpr * ppv), mcc, tpr + tnr - 1, ppv + npv - 1, op]
 
-	# names.append('Positive_likelihood_ratio')
-	# results.append(get_plr())
+def get_metrics_from_counts(counts):
+	# every metric of get_metrics() except AUC, each derived once from counts and without global state
+	results = [float(value) for value in get_metric_arrays(*counts)]
+	return results, list(METRIC_NAMES)
 
-	# names.append('Negative_likelihood_ratio')
-	# results.append(get_nlr())
-
-	# names.append('Diagnostic_odds_ratio')
-	# results.append(get_dor())
-
-	names.append('Optimized_precision')
-	results.append(get_OP())
+def get_metrics(est, gt):
+	results, names = get_metrics_from_counts(get_counts(est, gt))
 
 	names.append('AUC')
 	results.append(get_AUC(est,gt))
 
 	return results, names
 
+def get_multiclass_confusion(est, gt, labels=None):
+	# (labels, KxK confusion matrix) for any number of classes; labels defaults to every label in est or gt and
+	# samples with a label outside labels are not counted
+	est = np.asarray(est)
+	gt = np.asarray(gt)
+	labels = np.union1d(est, gt) if labels is None else np.sort(np.asarray(labels))
+	n_classes = labels.size
+	est_index = np.clip(np.searchsorted(labels, est), 0, max(n_classes - 1, 0))
+	gt_index = np.clip(np.searchsorted(labels, gt), 0, max(n_classes - 1, 0))
+	known = (labels[est_index] == est) & (labels[gt_index] == gt) if n_classes else np.zeros(est.shape, dtype=bool)
+	return labels, get_index_confusion(est_index[known], gt_index[known], n_classes)
+
+def get_multiclass_metrics(est, gt, labels=None):
+	# Per-class (one-vs-rest), macro and micro versions of the get_metrics() metrics except AUC.
+	# Returns labels, names, per_class (K x n_metrics), macro and micro (n_metrics each). Macro averages the
+	# per-class values, ignoring classes where a metric is undefined; micro pools the one-vs-rest counts, except
+	# for Accuracy, which is the multiclass accuracy: the fraction of samples whose class is predicted correctly.
+	labels, cells = get_multiclass_confusion(est, gt, labels)
+	counts = get_class_counts(cells)
+	per_class = np.column_stack(get_metric_arrays(*counts)).reshape(-1, len(METRIC_NAMES))
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)  # all-nan columns stay nan
+		macro = np.nanmean(per_class, axis=0)
+	micro = np.array(get_metric_arrays(*(c.sum() for c in counts)))
+	# pooled one-vs-rest accuracy counts every sample once per class, so it would credit wrong predictions too
+	micro[METRIC_NAMES.index('Accuracy')] = ratio(np.trace(cells), cells.sum())
+	return labels, list(METRIC_NAMES), per_class, macro, micro
+
+def get_group_counts(est, gt, groups):
+	# (group names, ConfusionCounts of arrays with one entry per group) from a single bincount over the
+	# group x gt x est grid; groups holds any label (e.g. a site or demographic group) per sample
+	names, group_index = np.unique(np.asarray(groups), return_inverse=True)
+	group_index = group_index.ravel()
+	cells = np.bincount(9 * group_index + 3 * get_label_index(gt) + get_label_index(est),
+						minlength=9 * names.size).reshape(names.size, 3, 3).astype(np.float64)
+	return names, ConfusionCounts(TP=cells[:, 1, 1], FP=cells[:, 0, 1], TN=cells[:, 0, 0], FN=cells[:, 1, 0])
+
+def get_group_AUC(scores, gt, groups):
+	# (group names, AUC per group) from one sort of the samples by (group, score): the Mann-Whitney statistic of
+	# get_AUC() within each group, from the positives and negatives of each run of tied scores
+	names, group_index = np.unique(np.asarray(groups), return_inverse=True)
+	group_index = group_index.ravel()
+	scores = np.asarray(scores, dtype=np.float64)
+	gt_index = get_label_index(gt)
+	valid = gt_index < 2
+	order = np.lexsort((scores[valid], group_index[valid]))
+	scores = scores[valid][order]
+	group_index = group_index[valid][order]
+	positive = gt_index[valid][order] == 1
+	if scores.size == 0:
+		return names, np.full(names.size, np.nan)
+
+	run_start = np.ones(scores.size, dtype=bool)
+	run_start[1:] = (scores[1:] != scores[:-1]) | (group_index[1:] != group_index[:-1])
+	run_id = np.cumsum(run_start) - 1
+	run_pos = np.bincount(run_id, weights=positive).astype(np.float64)
+	run_neg = np.bincount(run_id, weights=~positive).astype(np.float64)
+	run_group = group_index[run_start]
+
+	# negatives in the lower-scored runs of the same group
+	neg_before = np.cumsum(run_neg) - run_neg
+	group_first_run = np.searchsorted(run_group, np.arange(names.size))
+	neg_below = neg_before - neg_before[np.minimum(group_first_run, max(run_group.size - 1, 0))][run_group]
+
+	wins = np.bincount(run_group, weights=run_pos * (neg_below + 0.5 * run_neg), minlength=names.size)
+	num_p = np.bincount(run_group, weights=run_pos, minlength=names.size)
+	num_n = np.bincount(run_group, weights=run_neg, minlength=names.size)
+	return names, ratio(wins, num_p * num_n)
+
+def get_group_metrics(est, gt, groups, scores=None):
+	# (group names, metric names, values) with values[i] every get_metrics() metric for group i, all groups at
+	# once. AUC is computed from scores if given, else from est as in get_metrics().
+	names, counts = get_group_counts(est, gt, groups)
+	values = np.column_stack(get_metric_arrays(*counts) + [get_group_AUC(est if scores is None else scores, gt, groups)[1]])
+	return names, list(METRIC_NAMES) + ['AUC'], values.reshape(names.size, len(METRIC_NAMES) + 1)
+
+def get_AUC_from_histograms(neg, pos):
+	# Mann-Whitney U from negative/positive counts per ascending score bin (last axis): each positive beats the
+	# negatives in lower bins and ties half of those in its own bin. nan where either class is empty.
+	neg = np.asarray(neg, dtype=np.float64)
+	pos = np.asarray(pos, dtype=np.float64)
+	neg_below = np.cumsum(neg, axis=-1) - neg
+	return ratio(np.sum(pos * (neg_below + 0.5 * neg), axis=-1), pos.sum(axis=-1) * neg.sum(axis=-1))
+
+class MetricAccumulator(object):
+	# Confusion counts and per-class score histograms, updated chunk by chunk.
+	#
+	# Accumulators built from disjoint shards of the data can be merged exactly. AUC comes from a fixed-bin
+	# histogram of the scores on [0, 1]; it is exact for hard 0/1 predictions and otherwise resolved to 1/n_bins.
+
+	def __init__(self, n_bins=1000):
+		self.n_bins = n_bins
+		self.cells = np.zeros((3, 3), dtype=np.int64)
+		self.hist = np.zeros((2, n_bins), dtype=np.int64)  # rows: gt == 0, gt == 1
+
+	def update(self, est, gt, scores=None):
+		est = np.asarray(est)
+		gt = np.asarray(gt)
+		if est.shape != gt.shape:
+			raise ValueError('prediction and ground truth chunks differ in length (%d vs %d)' % (est.size, gt.size))
+		gt_index = get_label_index(gt)
+		self.cells += get_index_confusion(get_label_index(est), gt_index, 3)
+
+		scores = est if scores is None else np.asarray(scores)
+		bins = np.clip(np.floor(scores * self.n_bins), 0, self.n_bins - 1).astype(np.intp)
+		valid = gt_index < 2
+		self.hist += np.bincount(gt_index[valid] * self.n_bins + bins[valid], minlength=2 * self.n_bins).reshape(2, self.n_bins)
+		return self
+
+	def merge(self, other):
+		if other.n_bins != self.n_bins:
+			raise ValueError('cannot merge accumulators with %d and %d bins' % (self.n_bins, other.n_bins))
+		self.cells += other.cells
+		self.hist += other.hist
+		return self
+
+	def get_counts(self):
+		return ConfusionCounts(TP=float(self.cells[1, 1]), FP=float(self.cells[0, 1]),
+							   TN=float(self.cells[0, 0]), FN=float(self.cells[1, 0]))
+
+	def get_AUC(self):
+		return float(get_AUC_from_histograms(self.hist[0], self.hist[1]))
+
+	def get_metrics(self):
+		results, names = get_metrics_from_counts(self.get_counts())
+		names.append('AUC')
+		results.append(self.get_AUC())
+		return results, names
+
+# largest number of resampled indices drawn at once, which bounds bootstrap memory
+BOOTSTRAP_BLOCK_SIZE = 1 << 22
+
+def bootstrap_block(codes, auc_keys, n_levels, n_reps, seed):
+	# metrics for n_reps bootstrap replicates, drawn as one (n_reps, n) index matrix
+	n = codes.size
+	rng = np.random.default_rng(seed)
+	idx = rng.integers(0, n, size=(n_reps, n))
+	rep = np.arange(n_reps)[:, np.newaxis]
+
+	cells = np.bincount((9 * rep + codes[idx]).ravel(), minlength=9 * n_reps).reshape(n_reps, 3, 3)
+	results = get_metric_arrays(cells[:, 1, 1], cells[:, 0, 1], cells[:, 0, 0], cells[:, 1, 0])
+
+	# per replicate score histograms over the distinct score levels, for gt == 0 and gt == 1
+	keys = auc_keys[idx]
+	valid = keys >= 0
+	hist = np.bincount((2 * n_levels * rep + keys)[valid], minlength=2 * n_levels * n_reps).reshape(n_reps, 2, n_levels)
+	results.append(get_AUC_from_histograms(hist[:, 0], hist[:, 1]))
+
+	return np.column_stack(results)
+
+def get_bootstrap_metrics(est, gt, n_boot=1000, seed=0, workers=1, scores=None):
+	# (n_boot, n_metrics) array of get_metrics() for n_boot resamples of (est, gt).
+	#
+	# Replicates are drawn in blocks with seeds spawned from seed, so the result depends only on seed and the
+	# data, not on the number of worker processes the blocks are split across.
+	est = np.asarray(est)
+	gt_index = get_label_index(gt)
+	codes = 3 * gt_index + get_label_index(est)
+
+	scores = est if scores is None else np.asarray(scores)
+	levels, level_index = np.unique(scores, return_inverse=True)
+	auc_keys = np.where(gt_index < 2, gt_index * levels.size + level_index.ravel(), -1)
+
+	block = max(1, min(n_boot, BOOTSTRAP_BLOCK_SIZE // max(codes.size, 1)))
+	sizes = [min(block, n_boot - start) for start in range(0, n_boot, block)]
+	seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+	tasks = [(codes, auc_keys, levels.size, size, block_seed) for size, block_seed in zip(sizes, seeds)]
+
+	if workers > 1 and len(tasks) > 1:
+		from concurrent.futures import ProcessPoolExecutor
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			blocks = list(pool.map(bootstrap_block, *zip(*tasks)))
+	else:
+		blocks = [bootstrap_block(*task) for task in tasks]
+	return np.vstack(blocks)
+
+def get_bootstrap_ci(est, gt, n_boot=1000, alpha=0.05, seed=0, workers=1):
+	# percentile bootstrap (1 - alpha) confidence intervals for every metric of get_metrics()
+	values = get_bootstrap_metrics(est, gt, n_boot=n_boot, seed=seed, workers=workers)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)  # metrics undefined in every replicate stay nan
+		lower, upper = np.nanpercentile(values, [100 * alpha / 2., 100 * (1 - alpha / 2.)], axis=0)
+	return list(lower), list(upper)
+
+def get_threshold_counts(scores, gt):
+	# confusion counts for the prediction (scores >= threshold) at every distinct threshold, in descending order.
+	# One sort of the scores followed by cumulative sums, so the whole sweep is O(n log n).
+	scores = np.asarray(scores, dtype=np.float64)
+	gt_index = get_label_index(gt)
+	valid = gt_index < 2
+	scores = scores[valid]
+	positive = gt_index[valid] == 1
+
+	order = np.argsort(-scores, kind='mergesort')
+	scores = scores[order]
+	positive = positive[order]
+	TP = np.cumsum(positive)
+	FP = np.arange(1, scores.size + 1) - TP
+
+	# the last position of each run of tied scores is where that threshold takes effect
+	last = np.append(np.nonzero(np.diff(scores))[0], scores.size - 1) if scores.size else np.zeros(0, dtype=np.intp)
+	TP = TP[last].astype(np.float64)
+	FP = FP[last].astype(np.float64)
+	num_p = float(np.sum(positive))
+	num_n = float(scores.size) - num_p
+	return scores[last], ConfusionCounts(TP=TP, FP=FP, TN=num_n - FP, FN=num_p - TP)
+
+def get_threshold_sweep(scores, gt):
+	# (thresholds, names, values) with values[i] the get_metrics() metrics (except AUC) at thresholds[i]
+	thresholds, counts = get_threshold_counts(scores, gt)
+	return thresholds, list(METRIC_NAMES), np.column_stack(get_metric_arrays(*counts)).reshape(-1, len(METRIC_NAMES))
+
+def get_best_threshold(scores, gt, metric='Matthews_CC'):
+	# (threshold, value) maximising metric over the sweep; ties go to the highest threshold
+	return get_sweep_best(get_threshold_sweep(scores, gt), metric)
+
+def get_sweep_best(sweep, metric='Matthews_CC'):
+	# (threshold, value) maximising metric in an already computed get_threshold_sweep() result
+	thresholds, names, values = sweep
+	column = values[:, names.index(metric)]
+	if not np.any(np.isfinite(column)):
+		return np.nan, np.nan
+	best = np.nanargmax(np.where(np.isfinite(column), column, np.nan))
+	return float(thresholds[best]), float(column[best])
+
 def evaluate_prediction(est, gt):
 
 	# calculate metrics
@@ -246,13 +488,155 @@ def evaluate_prediction(est, gt):
 
 	return results, names
 
-def read_file(filename):
-	data = []
-	with open(filename, 'r') as fid:
-		reader = csv.reader(fid)
-		for row in reader:
-			data.append(np.int(row[0]))
-	return np.asarray(data)
+# labels accepted by the binary metrics
+BINARY_LABELS = (0, 1)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+def is_gzip(filename):
+	with open(filename, 'rb') as fid:
+		return fid.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+def open_text(filename):
+	# open filename for reading as text, decompressing it on the fly if it is gzip-compressed
+	return gzip.open(filename, 'rt') if is_gzip(filename) else open(filename, 'r')
+
+def parse_column(filename, lines, dtype):
+	# parse the first comma separated column of lines (a file name or list of lines) straight into an array of dtype
+	try:
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', UserWarning)  # empty input
+			return np.loadtxt(lines, dtype=dtype, delimiter=',', usecols=0, ndmin=1, comments=None)
+	except ValueError as e:
+		raise ValueError('%s: %s' % (filename, e))
+
+def check_values(filename, values, valid, first_row=0, row_numbers=None):
+	# raise ValueError if any of values is outside the inclusive range valid = (low, high), or is nan.
+	# row_numbers optionally gives the 0-based file row of each value, where blank lines were skipped
+	low, high = valid
+	bad = ~((values >= low) & (values <= high))
+	if bad.any():
+		rows = np.flatnonzero(bad)
+		row = row_numbers[rows[0]] if row_numbers is not None else first_row + rows[0]
+		raise ValueError('%s: %d value(s) outside [%s, %s], first %s at row %d'
+						 % (filename, rows.size, low, high, values[rows[0]], row + 1))
+
+def read_file(filename, dtype=int, n_rows=None, valid=None):
+	# read the first column of a (possibly gzip-compressed) CSV file into an array of dtype.
+	# n_rows is the expected number of rows and valid an inclusive (low, high) range of values, checked if given.
+	if is_gzip(filename):
+		# decompressing whole and splitting lines at once is several times faster than iterating a gzip stream
+		with gzip.open(filename, 'rt') as fid:
+			data = parse_column(filename, fid.read().splitlines(), dtype)
+	else:
+		data = parse_column(filename, filename, dtype)
+	if n_rows is not None and data.size != n_rows:
+		raise ValueError('%s: expected %d rows, found %d' % (filename, n_rows, data.size))
+	if valid is not None:
+		check_values(filename, data, valid)
+	return data
+
+def read_chunks(filename, chunk_rows, valid=None):
+	# yield the labels of filename as arrays of chunk_rows labels (the last may be shorter). Chunks are cut on
+	# non-blank lines, which are the ones parse_column keeps, so two files stay in step whatever blank lines they have
+	with open_text(filename) as fid:
+		lines = ((row, line) for row, line in enumerate(fid) if line.strip())
+		while True:
+			chunk = list(itertools.islice(lines, chunk_rows))
+			if not chunk:
+				return
+			row_numbers, chunk = zip(*chunk)
+			labels = parse_column(filename, list(chunk), int)
+			if valid is not None:
+				check_values(filename, labels, valid, row_numbers=row_numbers)
+			yield labels
+
+def evaluate_stream(prediction_file, groundtruth_file, chunk_rows):
+	accumulator = MetricAccumulator()
+	for est, gt in itertools.zip_longest(read_chunks(prediction_file, chunk_rows, BINARY_LABELS),
+										 read_chunks(groundtruth_file, chunk_rows, BINARY_LABELS)):
+		if est is None or gt is None:
+			raise ValueError('%s and %s differ in length' % (prediction_file, groundtruth_file))
+		accumulator.update(est, gt)
+	return accumulator.get_metrics()
+
+# ground truth label indices of a leaderboard worker process, set by init_leaderboard() only in the worker
+# processes; in-process scoring passes them to read_submission() explicitly, so concurrent leaderboards never share it
+leaderboard_gt = None
+
+# largest number of (submission, row) cells counted in one bincount, which bounds leaderboard memory
+LEADERBOARD_BLOCK_SIZE = 1 << 24
+
+def find_submissions(prediction_dir):
+	# prediction files in prediction_dir, by name; hidden files and subdirectories are ignored
+	names = sorted(name for name in os.listdir(prediction_dir) if not name.startswith('.'))
+	return [os.path.join(prediction_dir, name) for name in names if os.path.isfile(os.path.join(prediction_dir, name))]
+
+def get_leaderboard_gt(gt):
+	# read-only ground truth label indices, as read_submission() expects them
+	gt_index = get_label_index(gt).astype(np.uint8)
+	gt_index.setflags(write=False)
+	return gt_index
+
+def init_leaderboard(gt):
+	# ProcessPoolExecutor initializer: the ground truth arrives once per worker process, not with every submission
+	global leaderboard_gt
+	leaderboard_gt = get_leaderboard_gt(gt)
+
+def read_submission(filename, gt=None):
+	# (codes, error) for one prediction file: its 3*gt+est confusion cell per row, or None and why it was rejected.
+	# gt comes from get_leaderboard_gt(); it defaults to the worker process's, set by init_leaderboard()
+	gt = leaderboard_gt if gt is None else gt
+	try:
+		est = read_file(filename, n_rows=gt.size, valid=BINARY_LABELS)
+	except (OSError, ValueError) as e:
+		return None, str(e)
+	return 3 * gt + est.astype(np.uint8), None
+
+def get_stacked_metrics(codes):
+	# (n_submissions, n_metrics) array of get_metrics() for a stack of equally long submissions, given as their
+	# (n_submissions, n) 3*gt+est confusion cells: all confusion matrices come from one bincount
+	codes = np.asarray(codes, dtype=np.intp)
+	n_subs = codes.shape[0]
+	rep = np.arange(n_subs)[:, np.newaxis]
+	cells = np.bincount((9 * rep + codes).ravel(), minlength=9 * n_subs).reshape(n_subs, 3, 3)
+	TP, FP, TN, FN = cells[:, 1, 1], cells[:, 0, 1], cells[:, 0, 0], cells[:, 1, 0]
+	# the predictions are the scores: negatives and positives in score bins 0 and 1
+	auc = get_AUC_from_histograms(np.stack([TN, FP], axis=-1), np.stack([FN, TP], axis=-1))
+	return np.column_stack(get_metric_arrays(TP, FP, TN, FN) + [auc]).reshape(n_subs, len(METRIC_NAMES) + 1)
+
+def get_leaderboard(files, gt, workers=1):
+	# (names, values, errors) for every prediction file scored against gt: values holds get_metrics() per file
+	# (nan rows for files that were rejected, whose reason is in errors).
+	#
+	# Files are read and validated on a pool of worker processes that each receive gt once; the accepted ones,
+	# all as long as gt, are scored in stacks of up to LEADERBOARD_BLOCK_SIZE cells.
+	gt = np.asarray(gt)
+	names = list(METRIC_NAMES) + ['AUC']
+	values = np.full((len(files), len(names)), np.nan)
+	errors = [None] * len(files)
+	block = max(1, LEADERBOARD_BLOCK_SIZE // max(gt.size, 1))
+
+	def score(submissions):
+		stack = []
+		for index, (codes, error) in submissions:
+			if codes is None:
+				errors[index] = error
+			else:
+				stack.append((index, codes))
+			if len(stack) == block:
+				values[[i for i, _ in stack]] = get_stacked_metrics([c for _, c in stack])
+				stack = []
+		if stack:
+			values[[i for i, _ in stack]] = get_stacked_metrics([c for _, c in stack])
+
+	if workers > 1 and len(files) > 1:
+		from concurrent.futures import ProcessPoolExecutor
+		with ProcessPoolExecutor(max_workers=workers, initializer=init_leaderboard, initargs=(gt,)) as pool:
+			score(enumerate(pool.map(read_submission, files)))
+	else:
+		score(enumerate(map(functools.partial(read_submission, gt=get_leaderboard_gt(gt)), files)))
+	return names, values, errors
 
 #=============================================
 # Main method
@@ -261,9 +645,20 @@ def main(argv):
 	prediction_file = None
 	groundtruth_file = None
 	output_file = None
+	chunk_rows = 0
+	n_boot = 0
+	seed = 0
+	workers = 1
+	sweep_metric = None
+	multiclass = False
+	group_file = None
+	scores_file = None
+	prediction_dir = None
 
 	try:
-		opts, args = getopt.getopt(argv[1:],"hp:g:o:",["prediction=","groundtruth=","output="])
+		opts, args = getopt.getopt(argv[1:],"hp:g:o:s:b:r:j:t:kG:c:L:",["prediction=","groundtruth=","output=","stream=",
+																	 "bootstrap=","seed=","workers=","sweep=","multiclass",
+																	 "groups=","scores=","leaderboard="])
 	except getopt.GetoptError:
 		help()
 
@@ -277,22 +672,119 @@ def main(argv):
 			groundtruth_file = arg
 		elif opt in ('-o', '--output'):
 			output_file = arg
+		elif opt in ('-s', '--stream'):
+			chunk_rows = int(arg)
+		elif opt in ('-b', '--bootstrap'):
+			n_boot = int(arg)
+		elif opt in ('-r', '--seed'):
+			seed = int(arg)
+		elif opt in ('-j', '--workers'):
+			workers = int(arg)
+		elif opt in ('-t', '--sweep'):
+			sweep_metric = arg
+		elif opt in ('-k', '--multiclass'):
+			multiclass = True
+		elif opt in ('-G', '--groups'):
+			group_file = arg
+		elif opt in ('-c', '--scores'):
+			scores_file = arg
+		elif opt in ('-L', '--leaderboard'):
+			prediction_dir = arg
+
+	if prediction_dir is not None:
+		# one table for every submission in prediction_dir
+		if ((prediction_file is not None) or (groundtruth_file is None) or (output_file is None) or (chunk_rows > 0)
+				or (n_boot > 0) or (sweep_metric is not None) or multiclass or (group_file is not None)):
+			help()
+		files = find_submissions(prediction_dir)
+		names, values, errors = get_leaderboard(files, read_file(groundtruth_file, valid=BINARY_LABELS), workers)
+		with open(output_file, 'w') as fid:
+			writer = csv.writer(fid)
+			writer.writerow(['Submission'] + names + ['Error'])
+			for filename, row, error in zip(files, values, errors):
+				writer.writerow([os.path.basename(filename)] + list(row) + [error or ''])
+		for filename, error in zip(files, errors):
+			if error is not None:
+				print("rejected %s" % error)
+		return
 
 	if (prediction_file is None) or (groundtruth_file is None) or (output_file is None):
 		help()
+	if (chunk_rows > 0) and (n_boot > 0):
+		# resampling needs the whole dataset in memory
+		help()
+	if (group_file is not None) and ((chunk_rows > 0) or (n_boot > 0) or (sweep_metric is not None) or multiclass):
+		help()
+	if (sweep_metric is not None) and (sweep_metric not in METRIC_NAMES):
+		print("unknown metric for --sweep: %s (choose from %s)" % (sweep_metric, ', '.join(METRIC_NAMES)))
+		help()
 
-	# read input
-	est = read_file(prediction_file)
-	gt = read_file(groundtruth_file)
-
-	# calculate metrics
-	results, names = evaluate_prediction(est, gt)
-
-	# save output
+	if sweep_metric is not None:
+		# threshold sweep over probability scores
+		gt = read_file(groundtruth_file, valid=BINARY_LABELS)
+		scores = read_file(prediction_file, dtype=float, n_rows=gt.size, valid=(-np.inf, np.inf))
+		sweep = get_threshold_sweep(scores, gt)
+		thresholds, names, values = sweep
+		with open(output_file, 'w') as fid:
+			writer = csv.writer(fid)
+			writer.writerow(['Threshold'] + names)
+			for threshold, row in zip(thresholds, values):
+				writer.writerow([threshold] + list(row))
+		threshold, value = get_sweep_best(sweep, sweep_metric)
+		print("Best %s: %s at threshold %s" % (sweep_metric, value, threshold))
+		return
+
+	if group_file is not None:
+		# every metric per group, all groups from one pass over the data
+		gt = read_file(groundtruth_file, valid=BINARY_LABELS)
+		est = read_file(prediction_file, n_rows=gt.size, valid=BINARY_LABELS)
+		groups = read_file(group_file, dtype=str, n_rows=gt.size)
+		scores = None
+		if scores_file is not None:
+			scores = read_file(scores_file, dtype=float, n_rows=gt.size, valid=(-np.inf, np.inf))
+		groups_found, names, values = get_group_metrics(est, gt, groups, scores)
+		overall, _ = get_metrics(est, gt)
+		if scores is not None:
+			overall[-1] = get_AUC(scores, gt)
+		with open(output_file, 'w') as fid:
+			writer = csv.writer(fid)
+			writer.writerow(['Group', 'Metric', 'Value'])
+			for group, row in list(zip(groups_found, values)) + [('all', overall)]:
+				for name, value in zip(names, row):
+					writer.writerow([group, name, value])
+		return
+
+	if multiclass:
+		# KxK confusion matrix, metrics per class and averaged
+		gt = read_file(groundtruth_file)
+		labels, names, per_class, macro, micro = get_multiclass_metrics(read_file(prediction_file, n_rows=gt.size), gt)
+		with open(output_file, 'w') as fid:
+			writer = csv.writer(fid)
+			writer.writerow(['Class', 'Metric', 'Value'])
+			for label, values in list(zip(labels, per_class)) + [('macro', macro), ('micro', micro)]:
+				for name, value in zip(names, values):
+					writer.writerow([label, name, value])
+		return
+
+	if chunk_rows > 0:
+		# read and score input chunk by chunk
+		results, names = evaluate_stream(prediction_file, groundtruth_file, chunk_rows)
+	else:
+		# read input
+		gt = read_file(groundtruth_file, valid=BINARY_LABELS)
+		est = read_file(prediction_file, n_rows=gt.size, valid=BINARY_LABELS)
+
+		# calculate metrics
+		results, names = evaluate_prediction(est, gt)
+
+	# save output, with confidence interval columns when bootstrapping
+	columns = [names, results]
+	if n_boot > 0:
+		columns.extend(get_bootstrap_ci(est, gt, n_boot=n_boot, seed=seed, workers=workers))
 	with open(output_file, 'w') as fid:
 		writer = csv.writer(fid)
-		for ii in range(len(results)):
-			writer.writerow([names[ii],results[ii]])
+		for row in zip(*columns):
+			writer.writerow(row)
 
 if __name__ == "__main__":
 	main(sys.argv)
@@ -1,83 +1,53 @@
-#include <iostream>
-#include <cmath>
-
-using namespace std;
-
-typedef struct {
-    float x;
-    float y;
-    float z;
-}Point;
-Point points;
+// Batch rotation kernel for the cni_challenge C example.
+//
+// Applies x' = (R_x R_y R_z)^-1 x to every direction, using the same eddy rotation matrices as
+// example_python/rotate.py: the three per-axis matrices [[cos, sin, 0], [-sin, cos, 0], [0, 0, 1]] are combined
+// element-wise, giving [[a, b, 0], [-b, a, 0], [0, 0, 1]] with a = prod(cos), b = prod(sin), whose inverse is its
+// transpose divided by a^2 + b^2 in the upper 2x2 block.
+//
+// Built as a shared library (see Makefile) and called through ctypes from example_C/rotate.py, which passes
+// pointers straight into NumPy arrays. Strides are given in elements between rows so that columns 4-6 of the eddy
+// parameter array can be read in place.
 
-float rotationMatrix[4][4];
-float inputMatrix[4][1] = {0.0, 0.0, 0.0, 0.0};
-float outputMatrix[4][1] = {0.0, 0.0, 0.0, 0.0};
-
-void showPoint(){
-    cout<<"("<<outputMatrix[0][0]<<","<<outputMatrix[1][0]<<","<<outputMatrix[2][0]<<")"<<endl;
-}
+#include <cmath>
 
-void multiplyMatrix()
+template <typename T>
+static long rotateVectors(const T *rots, long rotStride, const T *bvecs, long bvecStride, T *out, long nDir)
 {
-    for(int i = 0; i < 4; i++ ){
-        for(int j = 0; j < 1; j++){
-            outputMatrix[i][j] = 0;
-            for(int k = 0; k < 4; k++){
-                outputMatrix[i][j] += rotationMatrix[i][k] * inputMatrix[k][j];
-            }
+    for(long i = 0; i < nDir; i++){
+        const T *rot = rots + i * rotStride;
+        const T *vec = bvecs + i * bvecStride;
+        T *res = out + 3 * i;
+
+        T a = std::cos(rot[0]) * std::cos(rot[1]) * std::cos(rot[2]);
+        T b = std::sin(rot[0]) * std::sin(rot[1]) * std::sin(rot[2]);
+        T det = a * a + b * b;
+        if(det == 0){
+            return i + 1;
         }
+
+        T x = vec[0];
+        T y = vec[1];
+        res[0] = (a * x - b * y) / det;
+        res[1] = (b * x + a * y) / det;
+        res[2] = vec[2];
     }
+    return 0;
 }
-void setUpRotationMatrix(float angle, float u, float v, float w)
-{
-    float L = (u*u + v * v + w * w);
-    angle = angle * M_PI / 180.0; //converting to radian value
-    float u2 = u * u;
-    float v2 = v * v;
-    float w2 = w * w;
 
-    rotationMatrix[0][0] = (u2 + (v2 + w2) * cos(angle)) / L;
-    rotationMatrix[0][1] = (u * v * (1 - cos(angle)) - w * sqrt(L) * sin(angle)) / L;
-    rotationMatrix[0][2] = (u * w * (1 - cos(angle)) + v * sqrt(L) * sin(angle)) / L;
-    rotationMatrix[0][3] = 0.0;
+// Both entry points return 0 on success, or 1 + the index of the first direction with a singular matrix.
+extern "C" {
 
-    rotationMatrix[1][0] = (u * v * (1 - cos(angle)) + w * sqrt(L) * sin(angle)) / L;
-    rotationMatrix[1][1] = (v2 + (u2 + w2) * cos(angle)) / L;
-    rotationMatrix[1][2] = (v * w * (1 - cos(angle)) - u * sqrt(L) * sin(angle)) / L;
-    rotationMatrix[1][3] = 0.0;
-
-    rotationMatrix[2][0] = (u * w * (1 - cos(angle)) - v * sqrt(L) * sin(angle)) / L;
-    rotationMatrix[2][1] = (v * w * (1 - cos(angle)) + u * sqrt(L) * sin(angle)) / L;
-    rotationMatrix[2][2] = (w2 + (u2 + v2) * cos(angle)) / L;
-    rotationMatrix[2][3] = 0.0;
-
-    rotationMatrix[3][0] = 0.0;
-    rotationMatrix[3][1] = 0.0;
-    rotationMatrix[3][2] = 0.0;
-    rotationMatrix[3][3] = 1.0;
+long rotate_vectors_f64(const double *rots, long rotStride, const double *bvecs, long bvecStride,
+                        double *out, long nDir)
+{
+    return rotateVectors<double>(rots, rotStride, bvecs, bvecStride, out, nDir);
 }
 
-int main()
+long rotate_vectors_f32(const float *rots, long rotStride, const float *bvecs, long bvecStride,
+                        float *out, long nDir)
 {
-    float angle;
-    float u, v, w;
-    cout<<"Enter the initial point you want to transform:";
-    cin>>points.x>>points.y>>points.z;
-    inputMatrix[0][0] = points.x;
-    inputMatrix[1][0] = points.y;
-    inputMatrix[2][0] = points.z;
-    inputMatrix[3][0] = 1.0;
-
-    cout<<"Enter axis vector: ";
-    cin>>u>>v>>w;
-
-    cout<<"Enter the rotating angle in degree: ";
-    cin>>angle;
-
-    setUpRotationMatrix(angle, u, v, w);
-    multiplyMatrix();
-    showPoint();
+    return rotateVectors<float>(rots, rotStride, bvecs, bvecStride, out, nDir);
+}
 
-    return 0;
-}
\ No newline at end of file
+}
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import ctypes
+import os
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+LIBDIR = os.path.dirname(os.path.abspath(__file__))
+LIBNAME = 'librotate.so'
+SOURCENAME = 'rotate.cpp'
+
+_lib = None
+# serialises checking, building and loading the library between the threads of a process
+_lib_lock = threading.Lock()
+
+def build_library():
+	# Compile librotate.so from rotate.cpp with the bundled Makefile, to a temporary name that is then moved into
+	# place, so other processes never load a half-written library
+	fd, tmp = tempfile.mkstemp(dir=LIBDIR, prefix='librotate.', suffix='.tmp')
+	os.close(fd)
+	try:
+		subprocess.check_call(['make', '-s', '-B', '-C', LIBDIR, 'OUT=' + os.path.basename(tmp), os.path.basename(tmp)])
+		os.replace(tmp, os.path.join(LIBDIR, LIBNAME))
+	except (OSError, subprocess.CalledProcessError) as e:
+		raise OSError('Unable to build %s in %s: %s' % (LIBNAME, LIBDIR, e))
+	finally:
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+def library_is_stale(libpath):
+	# True if librotate.so is missing or older than rotate.cpp, as the Makefile rule would decide
+	if not os.path.exists(libpath):
+		return True
+	source = os.path.join(LIBDIR, SOURCENAME)
+	return os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(libpath)
+
+def load_library():
+	global _lib
+	if _lib is not None:
+		return _lib
+	with _lib_lock:
+		if _lib is None:
+			_lib = open_library()
+	return _lib
+
+def open_library():
+	libpath = os.path.join(LIBDIR, LIBNAME)
+	if library_is_stale(libpath):
+		build_library()
+	lib = ctypes.CDLL(libpath)
+
+	for name, dtype in (('rotate_vectors_f64', np.float64), ('rotate_vectors_f32', np.float32)):
+		func = getattr(lib, name)
+		func.restype = ctypes.c_long
+		func.argtypes = [np.ctypeslib.ndpointer(dtype), ctypes.c_long,
+						 np.ctypeslib.ndpointer(dtype), ctypes.c_long,
+						 np.ctypeslib.ndpointer(dtype, flags='C_CONTIGUOUS,WRITEABLE'), ctypes.c_long]
+	return lib
+
+def row_stride(data, dtype):
+	# Return data (copied only if needed) and its row stride in elements, so the kernel can read it in place
+	data = np.asarray(data)
+	if data.dtype != dtype or data.strides[1] != data.itemsize or data.strides[0] % data.itemsize:
+		data = np.ascontiguousarray(data, dtype=dtype)
+	return data, data.strides[0] // data.itemsize
+
+def rotate_vectors(rots, bvecs, out=None):
+	# Native equivalent of example_python.rotate.rotate_vectors: rotate all (nDirs, 3) bvecs in one call.
+	# out is an optional C-contiguous (nDirs, 3) float32 or float64 array to write to (it may be bvecs itself), and
+	# sets the precision. Otherwise float32 inputs stay in single precision and anything else is computed in float64.
+	lib = load_library()
+	nDir = len(bvecs)
+	if len(rots) != nDir:
+		raise ValueError('rots and bvecs have a different number of rows')
+	if out is None:
+		dtype = np.float32 if np.asarray(rots).dtype == np.float32 and np.asarray(bvecs).dtype == np.float32 else np.float64
+		rotBvec = np.empty((nDir, 3), dtype=dtype)
+	else:
+		if out.dtype not in (np.float32, np.float64) or out.shape != (nDir, 3) or not out.flags.c_contiguous:
+			raise ValueError('out must be a C-contiguous (%d, 3) float32 or float64 array' % nDir)
+		dtype = out.dtype.type
+		rotBvec = out
+	func = lib.rotate_vectors_f32 if dtype == np.float32 else lib.rotate_vectors_f64
+	if nDir == 0:
+		return rotBvec
+
+	rots, rotStride = row_stride(rots, dtype)
+	bvecs, bvecStride = row_stride(bvecs, dtype)
+	status = func(rots, rotStride, bvecs, bvecStride, rotBvec, nDir)
+	if status:
+		raise np.linalg.LinAlgError('Singular matrix for direction %d' % (status - 1))
+	return rotBvec
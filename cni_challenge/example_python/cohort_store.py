@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+
+from . import vector_io
+
+# A store <path> is the data file <path>.bin, in vector_io's raw format, and the index <path>.idx
+DATA_EXTENSION = '.bin'
+INDEX_EXTENSION = '.idx'
+
+class CohortStore(object):
+	"""
+	Per-subject arrays (nRows x nCols each; nRows may differ between subjects) kept one after the other in a single
+	memory-mapped file, with an index of the rows holding each subject.
+
+	The index is a text file with one line per stored array: subject ID, first row, end row and, optionally, the
+	size and modification time of the file it came from. It is only ever appended to: storing a subject again
+	adds its new rows at the end of the data and a line that supersedes the old one, so existing data is never
+	rewritten. Lookups return views of the memory map, so reading a subject or a run of consecutive subjects
+	does not copy.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.data_file = path + DATA_EXTENSION
+		self.index_file = path + INDEX_EXTENSION
+		self.index = {}
+		self.order = []
+		self.data = None
+		self.load()
+
+	def load(self):
+		# (Re)read the index and memory-map the data
+		self.index = {}
+		if os.path.exists(self.index_file) and os.path.exists(self.data_file):
+			nRows = vector_io.read_raw_header(self.data_file)[1]
+			with open(self.index_file, 'r') as fid:
+				for line in fid:
+					fields = line.rstrip('\n').split('\t')
+					if len(fields) < 3 or int(fields[2]) > nRows:
+						continue  # written by an interrupted append
+					source = (int(fields[3]), int(fields[4])) if len(fields) >= 5 else None
+					self.index.pop(fields[0], None)
+					self.index[fields[0]] = (int(fields[1]), int(fields[2]), source)
+			self.data = vector_io.load_array(self.data_file)
+		else:
+			self.data = None
+		self.order = list(self.index)
+
+	@property
+	def subjects(self):
+		# subject IDs, in the order they were (last) stored
+		return list(self.order)
+
+	def __len__(self):
+		return len(self.index)
+
+	def __contains__(self, subject):
+		return subject in self.index
+
+	def __getitem__(self, subject):
+		# the (nRows, nCols) array of subject, as a read-only view of the memory map
+		start, stop, _ = self.index[subject]
+		return self.data[start:stop]
+
+	def source(self, subject):
+		# (size, mtime_ns) of the file subject was stored from, or None
+		entry = self.index.get(subject)
+		return entry[2] if entry is not None else None
+
+	def stack(self, subjects):
+		# (len(subjects), nRows, nCols) array of subjects that all have nRows rows: a view if they are stored
+		# consecutively in this order, otherwise a copy gathered from the memory map
+		ranges = np.array([self.index[subject][:2] for subject in subjects], dtype=np.int64).reshape(-1, 2)
+		nCols = self.data.shape[1] if self.data is not None else 0
+		if ranges.shape[0] == 0:
+			return np.zeros((0, 0, nCols))
+		nRows = ranges[0, 1] - ranges[0, 0]
+		if np.any(ranges[:, 1] - ranges[:, 0] != nRows):
+			raise ValueError('subjects have different numbers of rows')
+		if np.all(np.diff(ranges[:, 0]) == nRows):
+			return self.data[ranges[0, 0]:ranges[-1, 1]].reshape(-1, nRows, nCols)
+		rows = (ranges[:, :1] + np.arange(nRows)).ravel()
+		return self.data[rows].reshape(-1, nRows, nCols)
+
+	def append(self, items):
+		# Store (subject, array[, source]) items after the existing data, in one pass; items may be a generator, so
+		# only one subject's array need be in memory at a time. A subject that is already stored is superseded.
+		# Returns the subjects stored.
+		lines = []
+		writer = None
+		try:
+			for item in items:
+				subject, data, source = tuple(item) + (None,) * (3 - len(item))
+				if '\t' in subject or '\n' in subject:
+					raise ValueError('Invalid subject ID %r' % subject)
+				data = np.asarray(data)
+				data = data.reshape(1, -1) if data.ndim == 1 else data
+				if writer is None:
+					nCols = self.data.shape[1] if self.data is not None else data.shape[1]
+					dtype = self.data.dtype if self.data is not None else data.dtype
+					writer = vector_io.ArrayWriter(self.data_file, 'raw', nCols, dtype=dtype, append=True)
+				if data.shape[1] != writer.nCols:
+					raise ValueError('%s has %d columns, the store %d' % (subject, data.shape[1], writer.nCols))
+				start = writer.written
+				writer.write(data)
+				line = [subject, str(start), str(writer.written)]
+				if source is not None:
+					line.extend(str(value) for value in source)
+				lines.append('\t'.join(line) + '\n')
+		finally:
+			if writer is not None:
+				writer.close()
+			# the index is written last, so its lines only ever point at rows that are on disk
+			if lines:
+				with open(self.index_file, 'a') as fid:
+					fid.writelines(lines)
+				self.load()
+		return [line.split('\t', 1)[0] for line in lines]
+
+	def update_from_files(self, files, load=vector_io.load_array):
+		# Store every (subject, filename) whose file is not stored yet, or has changed size or modification time
+		# since it was. Returns the subjects that were (re)stored.
+		def changed():
+			for subject, filename in files:
+				st = os.stat(filename)
+				source = (st.st_size, st.st_mtime_ns)
+				if self.source(subject) != source:
+					yield subject, load(filename), source
+		return self.append(changed())
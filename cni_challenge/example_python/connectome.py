@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+
+from . import vector_io
+
+# Per-subject ROI time series (nTimepoints x nROIs), in any vector_io format
+TIMESERIES_NAMES = ('timeseries.txt', 'timeseries.npy', 'timeseries.bin')
+
+# Connectomes that can be extracted: Pearson correlation and partial correlation between ROIs
+CONNECTOME_KINDS = ('correlation', 'partial')
+
+# Subjects stacked into one batch of matrix operations; bounds the (batch, nTimepoints, nROIs) working array
+BATCH_SUBJECTS = 64
+
+def find_timeseries(subject_dir):
+	# Return the path of the ROI time series file in subject_dir, or None if there is none
+	for name in TIMESERIES_NAMES:
+		filename = os.path.join(subject_dir, name)
+		if os.path.exists(filename):
+			return filename
+	return None
+
+def correlation_matrices(series):
+	# (nSubjects, nTimepoints, nROIs) time series to (nSubjects, nROIs, nROIs) Pearson correlation matrices, all
+	# subjects in one batched matrix product. ROIs with a constant signal are uncorrelated with everything.
+	series = np.asarray(series, dtype=np.float64)
+	centred = series - series.mean(axis=1, keepdims=True)
+	norm = np.sqrt(np.einsum('stk,stk->sk', centred, centred))
+	norm[norm == 0] = np.inf
+	centred /= norm[:, np.newaxis, :]
+	corr = np.matmul(centred.transpose(0, 2, 1), centred)
+	# exact ones on the diagonal, also for constant ROIs
+	diag = np.arange(corr.shape[1])
+	corr[:, diag, diag] = 1
+	return np.clip(corr, -1, 1, out=corr)
+
+def partial_correlation_matrices(corr):
+	# Partial correlations -P_ij / sqrt(P_ii P_jj) from the precision matrices P, the batched (pseudo-)inverses of
+	# the correlation matrices; the pseudo-inverse keeps rank-deficient subjects (fewer timepoints than ROIs) finite.
+	precision = np.linalg.pinv(corr, hermitian=True)
+	diag = np.arange(corr.shape[1])
+	scale = np.sqrt(np.abs(precision[:, diag, diag]))
+	scale[scale == 0] = np.inf
+	partial = -precision / (scale[:, :, np.newaxis] * scale[:, np.newaxis, :])
+	partial[:, diag, diag] = 1
+	return np.clip(partial, -1, 1, out=partial)
+
+def upper_triangle(mats):
+	# (nSubjects, nROIs, nROIs) symmetric matrices to a contiguous float32 (nSubjects, nROIs * (nROIs - 1) / 2)
+	# feature matrix of their entries above the diagonal, row by row
+	rows, cols = np.triu_indices(mats.shape[1], k=1)
+	return np.ascontiguousarray(mats[:, rows, cols], dtype=np.float32)
+
+def connectome_features(series, kinds=CONNECTOME_KINDS):
+	# Return {kind: (nSubjects, nFeatures) float32} for a stack of equally shaped time series
+	corr = correlation_matrices(series)
+	features = {}
+	if 'correlation' in kinds:
+		features['correlation'] = upper_triangle(corr)
+	if 'partial' in kinds:
+		features['partial'] = upper_triangle(partial_correlation_matrices(corr))
+	return features
+
+def extract_features(files, kinds=CONNECTOME_KINDS, cache_dir=None, load=vector_io.load_array):
+	# Return {kind: (len(files), nFeatures) float32} with one row per time series file, in order.
+	#
+	# Subjects are computed in batches of up to BATCH_SUBJECTS with the same number of timepoints. With cache_dir,
+	# each subject's feature rows are stored under cache_dir/<kind> (a vector_io.ArrayCache, keyed by file path,
+	# size and modification time), so a re-run only computes subjects that are new or have changed.
+	# load(filename) returns a subject's time series, e.g. from a cohort_store.CohortStore instead of the file.
+	for kind in kinds:
+		if kind not in CONNECTOME_KINDS:
+			raise ValueError('Unknown connectome %s, expected one of %s' % (kind, ', '.join(CONNECTOME_KINDS)))
+	caches = {}
+	if cache_dir:
+		caches = dict((kind, vector_io.ArrayCache(os.path.join(cache_dir, kind))) for kind in kinds)
+
+	rows = dict((kind, [None] * len(files)) for kind in kinds)
+	missing = []
+	for index, filename in enumerate(files):
+		cached = [caches[kind].get(filename) for kind in kinds] if caches else [None]
+		if any(row is None for row in cached):
+			missing.append(index)
+		else:
+			for kind, row in zip(kinds, cached):
+				rows[kind][index] = row
+
+	series = dict((index, load(files[index])) for index in missing)
+	byShape = {}
+	for index in missing:
+		byShape.setdefault(series[index].shape, []).append(index)
+	for group in byShape.values():
+		for start in range(0, len(group), BATCH_SUBJECTS):
+			batch = group[start:start + BATCH_SUBJECTS]
+			features = connectome_features(np.stack([series[index] for index in batch]), kinds)
+			for kind in kinds:
+				for index, row in zip(batch, features[kind]):
+					rows[kind][index] = row
+					if caches:
+						caches[kind].put(files[index], row)
+
+	nFeatures = set(len(row) for kindRows in rows.values() for row in kindRows)
+	if len(nFeatures) > 1:
+		raise ValueError('Time series have different numbers of ROIs')
+	nFeatures = nFeatures.pop() if nFeatures else 0
+	return dict((kind, np.array(rows[kind], dtype=np.float32).reshape(len(files), nFeatures)) for kind in kinds)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import warnings
+
+import numpy as np
+
+from . import vector_io
+
+# eddy x-, y-, z- rotations (in radians) are stored in columns 4-6 of the fsl eddy parameter file
+ROTATION_COLUMNS = slice(3, 6)
+ROTATION_COLUMNS_INDEX = tuple(range(ROTATION_COLUMNS.start, ROTATION_COLUMNS.stop))
+
+def parse_rotations(lines):
+	# Parse the rotation columns from an eddy parameter file name or an iterable of its lines.
+	#
+	# NumPy's C tokenizer converts only the selected columns; it is faster than splitting lines in Python, which
+	# benchmarks/bench_suite.py (io group) checks against a plain loadtxt of every column.
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', UserWarning)  # empty input
+		return np.loadtxt(lines, usecols=ROTATION_COLUMNS_INDEX, ndmin=2, dtype=np.float64)
+
+# Parsed rotations are cached like any other array derived from a file
+RotationCache = vector_io.ArrayCache
+
+def load_rotations(filename, cache=None):
+	# Return the (nDirs, 3) rotations of an eddy parameter file in any vector_io format.
+	# Text files go through the column-selective parser, and through cache when one is given.
+	if vector_io.detect_format(filename) != 'text':
+		return vector_io.load_array(filename)[:, ROTATION_COLUMNS]
+
+	if cache is not None:
+		rots = cache.get(filename)
+		if rots is not None:
+			return rots
+
+	rots = parse_rotations(filename)
+	if cache is not None:
+		cache.put(filename, rots)
+	return rots
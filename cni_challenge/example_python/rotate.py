@@ -1,52 +1,283 @@
 #!/usr/bin/env python
 
+import contextlib
+import itertools
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
-def rotate_matrix(instrRot, instrbvec, ostr):
+from . import eddy_params
+from . import vector_io
+
+# Smallest number of rows worth handing to a thread of rotate_vectors_parallel
+MIN_PARALLEL_ROWS = 1 << 16
+
+# CPU quota files of cgroup v2 and v1, e.g. set by docker run --cpus or a Kubernetes CPU limit
+CGROUP_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_QUOTA = ('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+
+def rotation_coefficients(rots):
+	# Return (a, b) for (nDirs, 3) x-, y-, z- rotations (in radians), such that the eddy rotation matrix of each
+	# direction is [[a, b, 0], [-b, a, 0], [0, 0, 1]].
+	#
+	# Each per-axis matrix has the form [[cos, sin, 0], [-sin, cos, 0], [0, 0, 1]] and the three are combined
+	# element-wise (R_x * R_y * R_z), so the product only depends on a = prod(cos) and b = prod(sin).
+	rots = np.asarray(rots)
+	cosRot = np.cos(rots)
+	sinRot = np.sin(rots)
+	return cosRot[:, 0] * cosRot[:, 1] * cosRot[:, 2], sinRot[:, 0] * sinRot[:, 1] * sinRot[:, 2]
+
+def unique_rotations(rots):
+	# Return (uniqueRots, inverse) with rots == uniqueRots[inverse], merging runs of identical consecutive rows.
+	#
+	# eddy repeats the same motion parameters for consecutive volumes, so this finds the distinct motion states in a
+	# single O(nDirs) pass. Repeats that are not consecutive are kept separate: sorting to merge them costs more
+	# than the trigonometry it would save.
+	rots = np.asarray(rots)
+	nDir = rots.shape[0]
+	if nDir == 0:
+		return rots.reshape(0, 3), np.zeros(0, dtype=np.intp)
+
+	runStart = np.empty(nDir, dtype=bool)
+	runStart[0] = True
+	runStart[1:] = rots[1:, 0] != rots[:-1, 0]
+	for axis in (1, 2):
+		runStart[1:] |= rots[1:, axis] != rots[:-1, axis]
+	if np.all(runStart):
+		return rots, np.arange(nDir)
+	inverse = np.cumsum(runStart) - 1
+	return rots[runStart], inverse
+
+def rotate_vectors(rots, bvecs, out=None):
+	# x' = (R_x R_y R_z)^-1 x for every direction in one pass.
+	#
+	# out is an optional array, shaped like bvecs, to write the result to; it may be bvecs itself to rotate in
+	# place. Its dtype sets the precision: with float32 the coefficients are computed in single precision as
+	# well. Without it a new array of the common type of rots and bvecs is returned.
+	#
+	# The in-plane block [[a, b], [-b, a]] has inverse [[a, -b], [b, a]] / (a^2 + b^2), i.e. its transpose
+	# scaled by the block determinant, so no explicit inverse is needed.
+	#
+	# Matrix coefficients are only computed for the distinct rotations (see unique_rotations) and scattered back
+	# through the inverse index. Zero rotations give exactly the identity (a = 1, b = 0), so those vectors come
+	# back untouched, and a chunk made only of them is copied without any arithmetic.
+	rots = np.asarray(rots)
+	bvecs = np.asarray(bvecs)
+	rotBvec = np.empty(bvecs.shape, dtype=np.result_type(rots, bvecs, 1.0)) if out is None else out
+	if rotBvec.shape != bvecs.shape:
+		raise ValueError('out has shape %s, expected %s' % (rotBvec.shape, bvecs.shape))
+	inPlace = rotBvec is bvecs
+	if not inPlace and np.may_share_memory(rotBvec, bvecs):
+		raise ValueError('out must either be bvecs or not overlap it')
+
+	uniqueRots, inverse = unique_rotations(rots)
+	a, b = rotation_coefficients(uniqueRots.astype(rotBvec.dtype, copy=False))
+	det = a ** 2 + b ** 2
+	if np.any(det == 0):
+		raise np.linalg.LinAlgError('Singular matrix')
+
+	if not inPlace:
+		rotBvec[:, 2:] = bvecs[:, 2:]
+	if np.all((a == 1) & (b == 0)):
+		if not inPlace:
+			rotBvec[:, :2] = bvecs[:, :2]
+		return rotBvec
+
+	aScaled = a / det
+	bScaled = b / det
+	if aScaled.shape[0] != rotBvec.shape[0]:
+		aScaled = aScaled[inverse]
+		bScaled = bScaled[inverse]
+
+	# Products go through one scratch column rather than a temporary per term. In place, x is saved first since
+	# column 0 is overwritten before its last use.
+	x = bvecs[:, 0].copy() if inPlace else bvecs[:, 0]
+	y = bvecs[:, 1]
+	scratch = np.empty(rotBvec.shape[0], dtype=rotBvec.dtype)
+	np.multiply(bScaled, y, out=scratch)
+	np.multiply(aScaled, x, out=rotBvec[:, 0])
+	rotBvec[:, 0] -= scratch
+	np.multiply(bScaled, x, out=scratch)
+	np.multiply(aScaled, y, out=rotBvec[:, 1])
+	rotBvec[:, 1] += scratch
+	return rotBvec
+
+def cgroup_cpu_limit():
+	# Return the CPU quota of this container as a number of CPUs, or None if it is unlimited or unknown
+	try:
+		with open(CGROUP_CPU_MAX) as fid:
+			quota, period = fid.read().split()[:2]
+	except (OSError, ValueError):
+		try:
+			quota, period = [open(name).read().strip() for name in CGROUP_V1_QUOTA]
+		except OSError:
+			return None
+	if quota in ('max', '-1'):
+		return None
+	return float(quota) / float(period)
 
-	rots = np.loadtxt(instrRot)  # rots.shape = (nDirs, 16)
-	bvecs = np.loadtxt(instrbvec)
+def default_workers():
+	# Number of CPUs this process may actually use: its affinity mask, capped by any cgroup CPU quota
+	try:
+		cpus = len(os.sched_getaffinity(0))
+	except AttributeError:  # not available on macOS or Windows
+		cpus = os.cpu_count() or 1
+	limit = cgroup_cpu_limit()
+	if limit is not None:
+		cpus = min(cpus, max(1, int(math.ceil(limit))))
+	return cpus
 
+def rotate_vectors_parallel(rots, bvecs, out=None, workers=0, kernel=rotate_vectors, pool=None):
+	# rotate_vectors split into contiguous row blocks, one per thread, each written straight into its rows of a
+	# single preallocated output, so the result is identical to (and in the same order as) one kernel call.
+	# The NumPy and native kernels release the GIL, so threads run on separate cores.
+	# workers defaults to default_workers(); pool is an optional ThreadPoolExecutor to reuse across calls.
+	rots = np.asarray(rots)
+	bvecs = np.asarray(bvecs)
+	if rots.shape[0] != bvecs.shape[0]:
+		raise ValueError('rots and bvecs have a different number of rows')
+	rotBvec = np.empty(bvecs.shape, dtype=np.result_type(rots, bvecs, 1.0)) if out is None else out
+	workers = workers or default_workers()
 	nDir = bvecs.shape[0]
-	rotBvec = np.zeros((bvecs.shape))
+	blockRows = max(MIN_PARALLEL_ROWS, -(-nDir // workers))
+	if workers <= 1 or nDir <= blockRows:
+		return kernel(rots, bvecs, out=rotBvec)
 
-	# eddy x-, y-, z- rotations (in radians) are store in columns 4-6 of this fsl edd output textfile
-	# Cols 1:3 are the translations in x,y,z, 4:6 are rotations, and 7: are warp params
-	rots = rots[:, 3:6]  # nDirs x [x,y,z]
+	def rotate_block(start):
+		stop = start + blockRows
+		block = bvecs[start:stop]
+		# in place, each block's output must be the very array passed as its bvecs
+		kernel(rots[start:stop], block, out=block if rotBvec is bvecs else rotBvec[start:stop])
 
+	blocks = range(0, nDir, blockRows)
+	if pool is not None:
+		list(pool.map(rotate_block, blocks))
+	else:
+		with ThreadPoolExecutor(max_workers=workers) as blockPool:
+			list(blockPool.map(rotate_block, blocks))
+	return rotBvec
+
+def timed(stages, name):
+	# stages is an optional timer with a stage(name) context manager, such as instrumentation.StageTimer
+	return stages.stage(name) if stages is not None else contextlib.nullcontext()
+
+def line_chunks(fid, chunk_size):
+	# Yield successive lists of chunk_size non-blank lines from an open text file
+	lines = (line for line in fid if line.strip())
+	while True:
+		chunk = list(itertools.islice(lines, chunk_size))
+		if not chunk:
+			return
+		yield chunk
+
+def array_chunks(data, chunk_size):
+	for start in range(0, data.shape[0], chunk_size):
+		yield data[start:start + chunk_size]
+
+def rotation_chunks(instrRot, chunk_size, rot_cache=None):
+	# Text rotations are parsed chunk by chunk, only the rotation columns, unless a cached copy can be sliced instead
+	if rot_cache is None and vector_io.detect_format(instrRot) == 'text':
+		with open(instrRot, 'r') as fid:
+			for chunk in line_chunks(fid, chunk_size):
+				yield eddy_params.parse_rotations(chunk)
+	else:
+		for rots in array_chunks(eddy_params.load_rotations(instrRot, rot_cache), chunk_size):
+			yield rots
+
+def vector_chunks(instrbvec, chunk_size, dtype=np.float64):
+	# Text is parsed straight to dtype; binary chunks are views of the memory-mapped file in its own dtype
+	if vector_io.detect_format(instrbvec) == 'text':
+		with open(instrbvec, 'r') as fid:
+			for chunk in line_chunks(fid, chunk_size):
+				yield np.loadtxt(chunk, ndmin=2, dtype=dtype)
+	else:
+		for bvecs in array_chunks(vector_io.load_array(instrbvec), chunk_size):
+			yield bvecs
+
+def count_rows(filename):
+	if vector_io.detect_format(filename) != 'text':
+		return vector_io.load_array(filename).shape[0]
+	with open(filename, 'r') as fid:
+		return sum(1 for line in fid if line.strip())
+
+def output_buffer(bvecs, dtype, buf=None):
+	# Return (out, buf): where the kernel should write the rotation of bvecs. That is bvecs itself when it is a
+	# private writeable array of dtype (e.g. freshly parsed text), and otherwise the first rows of buf, which is
+	# allocated on first use and then reused for every chunk.
+	if bvecs.flags.writeable and bvecs.flags.c_contiguous and bvecs.dtype == dtype:
+		return bvecs, buf
+	if buf is None or buf.shape[0] < bvecs.shape[0] or buf.shape[1:] != bvecs.shape[1:]:
+		buf = np.empty(bvecs.shape, dtype=dtype)
+	return buf[:bvecs.shape[0]], buf
+
+def rotate_matrix_chunked(instrRot, instrbvec, ostr, chunk_size, out_format='text', rot_cache=None,
+						  kernel=rotate_vectors, stages=None, dtype=np.float64):
+	# Read both inputs in lockstep chunks and append each rotated chunk to ostr, so memory is bounded by chunk_size
+	nRows = count_rows(instrbvec) if out_format == 'npy' else None
+	buf = None
+	with vector_io.ArrayWriter(ostr, out_format, 3, nRows=nRows, dtype=dtype) as writer:
+		chunks = itertools.zip_longest(rotation_chunks(instrRot, chunk_size, rot_cache),
+									   vector_chunks(instrbvec, chunk_size, dtype))
+		while True:
+			with timed(stages, 'load'):
+				chunk = next(chunks, None)
+			if chunk is None:
+				break
+			rots, bvecs = chunk
+			if rots is None or bvecs is None or rots.shape[0] != bvecs.shape[0]:
+				raise ValueError('%s and %s have a different number of rows' % (instrRot, instrbvec))
+			with timed(stages, 'compute'):
+				out, buf = output_buffer(bvecs, dtype, buf)
+				rotBvec = kernel(rots, bvecs, out=out)
+			with timed(stages, 'save'):
+				writer.write(rotBvec)
+			if stages is not None:
+				stages.add_rows(rotBvec.shape[0])
+
+def rotate_matrix(instrRot, instrbvec, ostr, chunk_size=0, out_format='text', rot_cache=None, kernel=rotate_vectors,
+				  stages=None, dtype=np.float64, threads=1):
+	# Inputs may be text, .npy or raw binary (see vector_io); binary inputs are memory-mapped rather than parsed.
+	# rot_cache is an optional eddy_params.RotationCache that lets repeat runs skip parsing the rotation file.
+	# kernel computes the rotated vectors from (rots, bvecs), e.g. the native example_C.rotate.rotate_vectors.
+	# stages optionally records the time spent loading, computing and saving (see timed()).
+	# dtype (float64 or float32) is the precision of the whole pipeline: text vectors are parsed to it, rotated into
+	# a buffer of it (in place when possible) and binary outputs are stored in it.
+	# threads > 1 (or 0, for default_workers()) splits the rotation across a thread pool (see rotate_vectors_parallel),
+	# created only for inputs or chunks of at least 2 * MIN_PARALLEL_ROWS rows.
+	dtype = np.dtype(dtype)
+	threads = threads or default_workers()
+	if threads > 1:
+		# the pool is only started once an input (or chunk) is large enough to split across threads
+		with contextlib.ExitStack() as stack:
+			pools = []
+			def parallelKernel(rots, bvecs, out=None):
+				if len(bvecs) < 2 * MIN_PARALLEL_ROWS:
+					return kernel(rots, bvecs, out=out)
+				if not pools:
+					pools.append(stack.enter_context(ThreadPoolExecutor(max_workers=threads)))
+				return rotate_vectors_parallel(rots, bvecs, out, threads, kernel, pools[0])
+			rotate_matrix(instrRot, instrbvec, ostr, chunk_size, out_format, rot_cache, parallelKernel, stages, dtype)
+		return
+	if chunk_size > 0:
+		rotate_matrix_chunked(instrRot, instrbvec, ostr, chunk_size, out_format, rot_cache, kernel, stages, dtype)
+		return
+
+	with timed(stages, 'load'):
+		# eddy x-, y-, z- rotations (in radians) are store in columns 4-6 of this fsl edd output textfile
+		# Cols 1:3 are the translations in x,y,z, 4:6 are rotations, and 7: are warp params
+		rots = eddy_params.load_rotations(instrRot, rot_cache)  # nDirs x [x,y,z]
+		bvecs = vector_io.load_array(instrbvec, dtype)
+	if rots.shape[0] != bvecs.shape[0]:
+		raise ValueError('%s and %s have a different number of rows' % (instrRot, instrbvec))
 
 	# An assumption is made here that the first volume is b0- and is that all other volumes were registered to by eddy
-	for i in range(nDir):
-
-		origVec = bvecs[i, :]  # Get original gradient
-		rot = rots[i, :]  # Get rotations
-		rotationMats = np.zeros((3, 3, 3))
-
-		# For x-rotation
-		rotationMats[0, 0, 0] = np.cos(rot[0])
-		rotationMats[0, 1, 0] = np.sin(rot[0])
-		rotationMats[1, 0, 0] = -np.sin(rot[0])
-		rotationMats[1, 1, 0] = np.cos(rot[0])
-		rotationMats[2, 2, 0] = 1
-
-		# For y-rotation
-		rotationMats[0, 0, 1] = np.cos(rot[1])
-		rotationMats[0, 1, 1] = np.sin(rot[1])
-		rotationMats[1, 0, 1] = -np.sin(rot[1])
-		rotationMats[1, 1, 1] = np.cos(rot[1])
-		rotationMats[2, 2, 1] = 1
-
-		# For z-rotation
-		rotationMats[0, 0, 2] = np.cos(rot[2])
-		rotationMats[0, 1, 2] = np.sin(rot[2])
-		rotationMats[1, 0, 2] = -np.sin(rot[2])
-		rotationMats[1, 1, 2] = np.cos(rot[2])
-		rotationMats[2, 2, 2] = 1
-
-		# x' = (R_x R_y R_z)^-1 x
-		temp = np.dot(np.linalg.inv(rotationMats[:, :, 0] * rotationMats[:, :, 1] * rotationMats[:, :, 2]), origVec)
-		rotBvec[i,:] = temp
+	with timed(stages, 'compute'):
+		rotBvec = kernel(rots, bvecs, out=output_buffer(bvecs, dtype)[0])
 
 	# Output and save
-	np.savetxt(ostr, rotBvec, fmt='%0.7f', delimiter='\t')
-
+	with timed(stages, 'save'):
+		vector_io.save_array(ostr, rotBvec, out_format)
+	if stages is not None:
+		stages.add_rows(rotBvec.shape[0])
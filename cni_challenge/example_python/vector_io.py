@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+# Supported array formats and the extension used for outputs written in each
+FORMATS = ('text', 'npy', 'raw')
+EXTENSIONS = {'text': '.txt', 'npy': '.npy', 'raw': '.bin'}
+
+# Raw little-endian binary: a 16 byte header (magic, version, dtype char, nRows, nCols) followed by row-major data
+RAW_MAGIC = b'CNIRAW'
+RAW_VERSION = 1
+RAW_HEADER = struct.Struct('<6sBcII')
+RAW_DTYPES = {b'f': '<f4', b'd': '<f8'}
+
+NPY_MAGIC = b'\x93NUMPY'
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+def detect_format(filename):
+	# Identify the format of filename from its leading bytes; anything unrecognised is treated as text
+	with open(filename, 'rb') as fid:
+		magic = fid.read(len(RAW_MAGIC))
+	if magic == NPY_MAGIC:
+		return 'npy'
+	if magic == RAW_MAGIC:
+		return 'raw'
+	return 'text'
+
+def read_raw_header(filename):
+	with open(filename, 'rb') as fid:
+		header = fid.read(RAW_HEADER.size)
+	if len(header) < RAW_HEADER.size:
+		raise ValueError('%s: truncated raw header' % filename)
+	magic, version, dtype, nRows, nCols = RAW_HEADER.unpack(header)
+	if magic != RAW_MAGIC or version != RAW_VERSION or dtype not in RAW_DTYPES:
+		raise ValueError('%s: unsupported raw header' % filename)
+	return np.dtype(RAW_DTYPES[dtype]), nRows, nCols
+
+def load_array(filename, dtype=np.float64):
+	# Return a 2D array for filename. Binary formats are memory-mapped read-only, so slicing them does not copy,
+	# and keep their stored dtype; text is parsed to dtype.
+	fmt = detect_format(filename)
+	if fmt == 'npy':
+		data = np.load(filename, mmap_mode='r')
+	elif fmt == 'raw':
+		dtype, nRows, nCols = read_raw_header(filename)
+		if nRows == 0:
+			return np.zeros((0, nCols), dtype=dtype)
+		data = np.memmap(filename, dtype=dtype, mode='r', offset=RAW_HEADER.size, shape=(nRows, nCols))
+	else:
+		data = np.loadtxt(filename, ndmin=2, dtype=dtype)
+	if data.ndim == 1:
+		data = data.reshape(1, -1)
+	return data
+
+class ArrayWriter(object):
+	"""
+	Write a (nRows, nCols) array to disk one block of rows at a time.
+	With append, rows are added to the end of an existing raw file (which must have the same nCols and dtype)
+	without rewriting its data; the header's row count is updated on close.
+	"""
+	def __init__(self, filename, fmt, nCols, nRows=None, dtype=np.float64, append=False):
+		if fmt not in FORMATS:
+			raise ValueError('Unknown output format %s, expected one of %s' % (fmt, ', '.join(FORMATS)))
+		self.filename = filename
+		self.fmt = fmt
+		self.nCols = nCols
+		self.nRows = nRows
+		self.dtype = np.dtype(dtype).newbyteorder('<')
+		self.written = 0
+		self.fid = None
+		self.out = None
+
+		if append and fmt != 'raw':
+			raise ValueError('only raw output can be appended to')
+
+		if append and os.path.exists(filename):
+			existingDtype, existingRows, existingCols = read_raw_header(filename)
+			if existingDtype != self.dtype or existingCols != nCols:
+				raise ValueError('%s holds %d columns of %s, not %d of %s' % (filename, existingCols, existingDtype,
+																		   nCols, self.dtype))
+			self.written = existingRows
+			self.fid = open(filename, 'r+b')
+			self.fid.seek(RAW_HEADER.size + existingRows * nCols * self.dtype.itemsize)
+			self.fid.truncate()  # drop any rows of an interrupted append
+		elif fmt == 'npy':
+			if nRows is None:
+				raise ValueError('npy output needs the number of rows up front')
+			self.out = np.lib.format.open_memmap(filename, mode='w+', dtype=self.dtype, shape=(nRows, nCols))
+		elif fmt == 'raw':
+			if self.dtype.char.encode() not in RAW_DTYPES:
+				raise ValueError('raw output supports float32 or float64, not %s' % self.dtype)
+			self.fid = open(filename, 'wb')
+			self.fid.write(self.raw_header())
+		else:
+			self.fid = open(filename, 'w')
+
+	def raw_header(self):
+		return RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, self.dtype.char.encode(), self.written, self.nCols)
+
+	def write(self, block):
+		if self.fmt == 'npy':
+			self.out[self.written:self.written + block.shape[0]] = block
+		elif self.fmt == 'raw':
+			np.ascontiguousarray(block, dtype=self.dtype).tofile(self.fid)
+		else:
+			np.savetxt(self.fid, block, fmt='%0.7f', delimiter='\t')
+		self.written += block.shape[0]
+
+	def close(self, check=True):
+		if self.fmt == 'npy':
+			self.out.flush()
+			self.out = None
+			if check and self.written != self.nRows:
+				raise ValueError('%s: wrote %d of %d rows' % (self.filename, self.written, self.nRows))
+			return
+		if self.fmt == 'raw':
+			# Patch the row count now that it is known
+			self.fid.seek(0)
+			self.fid.write(self.raw_header())
+		self.fid.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close(check=excType is None)
+
+def save_array(filename, data, fmt='text'):
+	with ArrayWriter(filename, fmt, data.shape[1], nRows=data.shape[0], dtype=data.dtype) as writer:
+		writer.write(data)
+
+class ArrayCache(object):
+	"""
+	On-disk cache of arrays derived from files (e.g. parsed eddy rotations or connectome features), keyed by the
+	source file's path, size and modification time. Entries are .npy files; the least recently used are evicted
+	once the cache exceeds max_bytes.
+	"""
+	def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		os.makedirs(cache_dir, exist_ok=True)
+
+	def entry(self, filename):
+		st = os.stat(filename)
+		key = '%s\0%d\0%d' % (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+		return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+	def get(self, filename):
+		entry = self.entry(filename)
+		try:
+			data = np.load(entry, mmap_mode='r')
+			os.utime(entry)  # mark as recently used
+		except (OSError, ValueError):
+			return None
+		return data
+
+	def put(self, filename, data):
+		entry = self.entry(filename)
+		fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as fid:
+				np.save(fid, np.ascontiguousarray(data))
+			os.replace(tmp, entry)
+		except OSError:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+			raise
+		self.evict()
+
+	def evict(self):
+		entries = []
+		for name in os.listdir(self.cache_dir):
+			if not name.endswith('.npy'):
+				continue
+			try:
+				st = os.stat(os.path.join(self.cache_dir, name))
+			except OSError:
+				continue
+			entries.append((st.st_mtime, st.st_size, name))
+		entries.sort()
+
+		total = sum(size for _, size, _ in entries)
+		for _, size, name in entries:
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove(os.path.join(self.cache_dir, name))
+			except OSError:
+				pass
+			total -= size
@@ -0,0 +1,83 @@
+#
+# Per-stage timing and resource instrumentation for the cni_challenge plugin.
+#
+
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process so far in MB, or None if it cannot be measured.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return maxrss / (1024. * 1024. if sys.platform == 'darwin' else 1024.)
+
+
+class StageTimer(object):
+    """
+    Accumulate wall time, CPU time and memory for named stages (e.g. load, compute, save) of a run.
+    A stage may be entered several times, as in chunked processing; its times are summed.
+
+    ru_maxrss is the high-water mark of the whole process, so a stage cannot report its own peak. Each stage
+    records process_peak_rss_mb, the process peak so far when it last ended, and peak_rss_growth_mb, how much it
+    raised that peak (summed over its entries); a stage that used less memory than an earlier one shows 0.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.rows = 0
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        record = self.stages.setdefault(name, {'wall_s': 0., 'cpu_s': 0., 'process_peak_rss_mb': None,
+                                               'peak_rss_growth_mb': None})
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        rss_start = peak_rss_mb()
+        try:
+            yield
+        finally:
+            record['wall_s'] += time.perf_counter() - wall_start
+            record['cpu_s'] += time.process_time() - cpu_start
+            record['process_peak_rss_mb'] = peak_rss_mb()
+            if rss_start is not None:
+                record['peak_rss_growth_mb'] = ((record['peak_rss_growth_mb'] or 0.)
+                                                + record['process_peak_rss_mb'] - rss_start)
+
+    def add_rows(self, rows):
+        self.rows += rows
+
+    def rate(self, seconds):
+        return self.rows / seconds if seconds > 0 else None
+
+    def as_dict(self):
+        stages = OrderedDict()
+        for name, record in self.stages.items():
+            stages[name] = dict(record, rows_per_s=self.rate(record['wall_s']))
+        wall = time.perf_counter() - self.wall_start
+        total = {'wall_s': wall, 'cpu_s': time.process_time() - self.cpu_start, 'peak_rss_mb': peak_rss_mb(),
+                 'rows_per_s': self.rate(wall)}
+        return OrderedDict([('rows', self.rows), ('stages', stages), ('total', total)])
+
+    def save(self, filename, **extra):
+        """
+        Write the stage statistics, plus any extra key-value information, as JSON to filename.
+        """
+        stats = self.as_dict()
+        stats.update(extra)
+        with open(filename, 'w') as fid:
+            json.dump(stats, fid, indent=2)
+        return stats
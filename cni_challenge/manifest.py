@@ -0,0 +1,133 @@
+#
+# Run manifests for the cni_challenge plugin: a record, kept in outputdir, of the inputs, options and code a run's
+# outputs were computed from, so that a repeat run with nothing changed can skip the computation.
+#
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+HASH_BLOCK_SIZE = 1 << 20
+
+# A file modified this close to when it was hashed may have changed again within the filesystem's timestamp
+# resolution, so its hash is never reused from size and modification time alone
+RACY_NS = 2 * 10 ** 9
+
+
+def file_digest(filename, previous=None):
+    """
+    Return {'size', 'mtime_ns', 'hashed_ns', 'sha256'} for filename, hashing it in HASH_BLOCK_SIZE blocks.
+    If previous (an earlier result for the same file) has the same size and modification time, its hash is
+    reused rather than reading the file again, unless the file was modified within RACY_NS of being hashed.
+    """
+    stat = os.stat(filename)
+    if (previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns
+            and previous.get('hashed_ns', 0) - stat.st_mtime_ns > RACY_NS):
+        return previous
+    hashed_ns = time.time_ns()
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fid:
+        for block in iter(lambda: fid.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return OrderedDict([('size', stat.st_size), ('mtime_ns', stat.st_mtime_ns), ('hashed_ns', hashed_ns),
+                        ('sha256', digest.hexdigest())])
+
+
+def file_stat(filename):
+    """
+    Return {'size', 'mtime_ns'} for filename, which is all that is recorded of outputs: checking them needs no read.
+    """
+    stat = os.stat(filename)
+    return OrderedDict([('size', stat.st_size), ('mtime_ns', stat.st_mtime_ns)])
+
+
+def code_version(version, sources):
+    """
+    Return version plus a short hash of the source files that compute the outputs, so that editing them
+    invalidates earlier runs without a version bump.
+    """
+    digest = hashlib.sha256()
+    for filename in sources:
+        if os.path.exists(filename):
+            with open(filename, 'rb') as fid:
+                digest.update(fid.read())
+    return '%s+%s' % (version, digest.hexdigest()[:12])
+
+
+def read_manifest(filename):
+    """
+    Return the manifest saved in filename, or None if there is none or it cannot be read.
+    """
+    try:
+        with open(filename) as fid:
+            return json.load(fid)
+    except (OSError, ValueError):
+        return None
+
+
+class Manifest(object):
+    """
+    The inputs (by content hash), options and code version of a run, plus the outputs it wrote (by size and
+    modification time). Inputs are only hashed when first needed, by up_to_date() or save(), so a run that is
+    forced to recompute does not hash them before the computation.
+    """
+    def __init__(self, filename, inputs, options, version):
+        self.filename = filename
+        self.previous = read_manifest(filename) or {}
+        self.input_paths = OrderedDict(sorted(inputs.items()))
+        self.digests = None
+        self.options = OrderedDict(sorted(options.items()))
+        self.version = version
+
+    @property
+    def inputs(self):
+        """
+        The digest of each input, reusing the previous manifest's hashes of unchanged files (see file_digest).
+        """
+        if self.digests is None:
+            previousInputs = self.previous.get('inputs', {})
+            self.digests = OrderedDict((name, file_digest(path, previousInputs.get(name)))
+                                       for name, path in self.input_paths.items())
+        return self.digests
+
+    def up_to_date(self, outputs):
+        """
+        Return True if the previous run had the same inputs, options and code version and its outputs (a dict of
+        name: path) are still as it left them.
+        """
+        previous = self.previous
+        if (previous.get('version') != self.version or previous.get('options') != self.options
+                or sorted(previous.get('outputs', {})) != sorted(outputs)):
+            return False
+        previousHashes = dict((name, digest.get('sha256')) for name, digest in previous.get('inputs', {}).items())
+        if previousHashes != dict((name, digest['sha256']) for name, digest in self.inputs.items()):
+            return False
+        for name, path in outputs.items():
+            recorded = previous['outputs'][name]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if (stat.st_size, stat.st_mtime_ns) != (recorded['size'], recorded['mtime_ns']):
+                return False
+        return True
+
+    def invalidate(self):
+        """
+        Remove the saved manifest, so an interrupted run is never taken as up to date.
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def save(self, outputs):
+        record = OrderedDict([
+            ('version', self.version),
+            ('options', self.options),
+            ('inputs', self.inputs),
+            ('outputs', OrderedDict((name, file_stat(path)) for name, path in sorted(outputs.items()))),
+        ])
+        with open(self.filename, 'w') as fid:
+            json.dump(record, fid, indent=2)
+        self.previous = json.loads(json.dumps(record))
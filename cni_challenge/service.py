@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Persistent local worker service for the cni_challenge plugin.
+#
+# Each plugin run normally starts a fresh interpreter and re-imports chrisapp, NumPy and the evaluation code before
+# doing any work. The service keeps those modules loaded in one long-running process and runs rotate and evaluate
+# jobs on a bounded thread pool, taking requests over a Unix domain socket (single host, no network needed):
+#
+#     python service.py --socket /tmp/cni_challenge.sock --workers 4
+#
+# Cni_challenge.run sends its jobs here when started with --service_socket pointing at a running service, and runs
+# them in-process otherwise.
+#
+# Protocol: one request per connection, each a line of JSON, {"op": <name>, "args": {...}}, answered by a line of
+# JSON, {"ok": true, "result": ...} or {"ok": false, "error": "<message>"}.
+#
+
+import argparse
+import importlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+CONNECT_TIMEOUT = 1.0       # seconds to wait for the service to accept a connection
+
+
+class ServiceError(RuntimeError):
+    """
+    Raised by the client when the service reports that a job failed.
+    """
+
+
+def op_ping():
+    return {'pid': os.getpid()}
+
+
+def op_rotate(inputdir, outputdir, options):
+    """
+    Run rotate_subject from cni_challenge.py on one subject; options is the plugin's options as a dict.
+    """
+    try:
+        from cni_challenge.cni_challenge import rotate_subject      # imported as part of the package
+    except ImportError:
+        from cni_challenge import rotate_subject                    # run from the plugin directory
+    out_str, stats = rotate_subject(inputdir, outputdir, argparse.Namespace(**options))
+    return {'output': out_str, 'stats': stats}
+
+
+def op_evaluate(prediction, groundtruth, output, extra_args=()):
+    """
+    Score prediction against groundtruth into output, as classification_metrics.py -p -g -o [extra_args].
+    """
+    try:
+        from cni_challenge.evaluation import classification_metrics
+    except ImportError:
+        from evaluation import classification_metrics
+    classification_metrics.main(['classification_metrics.py', '-p', prediction, '-g', groundtruth,
+                                 '-o', output] + list(extra_args))
+    return {'output': output}
+
+
+OPERATIONS = {
+    'ping': op_ping,
+    'rotate': op_rotate,
+    'evaluate': op_evaluate,
+}
+
+
+def warm_up():
+    """
+    Import everything the operations need, so the first request does not pay for it.
+    """
+    try:
+        importlib.import_module('cni_challenge.cni_challenge')
+        importlib.import_module('cni_challenge.evaluation.classification_metrics')
+    except ImportError:
+        importlib.import_module('cni_challenge')
+        importlib.import_module('evaluation.classification_metrics')
+    importlib.import_module('example_python.rotate')
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            func = OPERATIONS[request['op']]
+            # The pool bounds how many jobs run at once; further connections wait for a free worker
+            result = self.server.pool.submit(func, **request.get('args', {})).result()
+            response = {'ok': True, 'result': result}
+        except KeyError as e:
+            response = {'ok': False, 'error': 'Invalid request: missing or unknown %s' % e}
+        except BaseException as e:
+            # SystemExit included: classification_metrics.help() exits on bad arguments
+            response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+        self.wfile.write((json.dumps(response, default=str) + '\n').encode('utf-8'))
+
+
+class WorkerService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix domain socket server running each request's job on a pool of 'workers' threads.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=DEFAULT_WORKERS):
+        if os.path.exists(socket_path):
+            if is_available(socket_path):
+                raise OSError('A service is already listening on %s' % socket_path)
+            os.remove(socket_path)      # left behind by a service that did not shut down cleanly
+        socketserver.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+        self.socket_path = socket_path
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.shutdown(wait=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def start_service(socket_path, workers=DEFAULT_WORKERS):
+    """
+    Start a WorkerService on a background thread and return it; stop it with shutdown() then server_close().
+    """
+    service = WorkerService(socket_path, workers)
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    return service
+
+
+def request(socket_path, op, timeout=None, **args):
+    """
+    Send one job to the service at socket_path and return its result. Raises OSError if the service cannot be
+    reached and ServiceError if the job failed. timeout (seconds) bounds the wait for the result; default none.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_path)
+        sock.settimeout(timeout)
+        with sock.makefile('rwb') as stream:
+            stream.write((json.dumps({'op': op, 'args': args}, default=str) + '\n').encode('utf-8'))
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise ServiceError('No response from the service at %s' % socket_path)
+    response = json.loads(line.decode('utf-8'))
+    if not response['ok']:
+        raise ServiceError(response['error'])
+    return response['result']
+
+
+def is_available(socket_path):
+    """
+    Return True if a service is answering on socket_path.
+    """
+    if not socket_path or not os.path.exists(socket_path):
+        return False
+    try:
+        request(socket_path, 'ping', timeout=CONNECT_TIMEOUT)
+    except (OSError, ValueError, ServiceError):
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Persistent worker service for cni_challenge rotate and '
+                                                 'evaluate jobs, listening on a Unix domain socket.')
+    parser.add_argument('--socket', required=True, help='path of the Unix domain socket to listen on')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of jobs run at once (default %d)' % DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+
+    warm_up()
+    service = WorkerService(args.socket, args.workers)
+    print('Serving on %s with %d worker(s)' % (args.socket, args.workers))
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
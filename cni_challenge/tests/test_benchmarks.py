@@ -0,0 +1,39 @@
+
+import importlib.util
+import os
+import sys
+from unittest import TestCase
+
+BENCH_SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks', 'bench_suite.py')
+
+
+def load_bench_suite():
+    """
+    Import benchmarks/bench_suite.py from its path, without adding benchmarks/ to sys.path.
+    """
+    spec = importlib.util.spec_from_file_location('bench_suite', BENCH_SUITE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bench_suite = load_bench_suite()
+
+
+class BenchSuiteTests(TestCase):
+    """
+    Smoke test the benchmark suite at a tiny size.
+    """
+    def test_run_and_compare(self):
+        results = bench_suite.run([100], io_max=100, repeat=1)
+        self.assertIn('rotate/numpy/100', results['results'])
+        self.assertIn('io/load_rotations_text/100', results['results'])
+        self.assertEqual(bench_suite.compare(results, results, 0.2), [])
+
+        slower = {'results': dict((key, 2 * seconds + 1) for key, seconds in results['results'].items())}
+        self.assertEqual(len(bench_suite.compare(results, slower, 0.2)), len(results['results']))
+
+    def test_import_leaves_sys_path(self):
+        before = list(sys.path)
+        load_bench_suite()
+        self.assertEqual(sys.path, before)
@@ -0,0 +1,317 @@
+
+import gzip
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase
+from unittest import mock
+from cni_challenge.evaluation import classification_metrics as cm
+
+
+def legacy_metrics(est, gt):
+    """
+    Metrics from the global-state get_*() helpers, in get_metrics() order.
+    """
+    cm.get_confusion_matrix(est, gt)
+    return [cm.get_tpr(), cm.get_tnr(), cm.get_ppv(), cm.get_npv(), cm.get_fnr(), cm.get_fpr(), cm.get_fdr(),
+            cm.get_for(), cm.get_accuracy(), cm.get_f1_score(), cm.get_geom_mean(), cm.get_mcc(), cm.get_bm(),
+            cm.get_markedness(), cm.get_OP(), cm.get_AUC(est, gt)]
+
+
+class ClassificationMetricsTests(TestCase):
+    """
+    Test the evaluation metrics.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(5)
+        self.gt = rng.randint(0, 2, 200)
+        self.est = rng.randint(0, 2, 200)
+
+    def test_counts(self):
+        counts = cm.get_counts(self.est, self.gt)
+        self.assertEqual(counts.TP, np.sum((self.est == 1) & (self.gt == 1)))
+        self.assertEqual(counts.FP, np.sum((self.est == 1) & (self.gt == 0)))
+        self.assertEqual(counts.TN, np.sum((self.est == 0) & (self.gt == 0)))
+        self.assertEqual(counts.FN, np.sum((self.est == 0) & (self.gt == 1)))
+
+    def test_counts_ignore_other_labels(self):
+        self.assertEqual(cm.get_counts(np.array([2, 1, 0]), np.array([0, 2, 1])), (0., 0., 0., 1.))
+
+    def test_matches_legacy(self):
+        for est in (self.est, np.ones_like(self.est), np.zeros_like(self.est)):
+            results, names = cm.get_metrics(est, self.gt)
+            self.assertEqual(len(names), 16)
+            np.testing.assert_array_equal(results, legacy_metrics(est, self.gt))
+
+    def test_main(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        evaldir = os.path.dirname(cm.__file__)
+        output_file = os.path.join(tmpdir, 'metrics.csv')
+        cm.main(['classification_metrics.py', '-p', os.path.join(evaldir, 'example_prediction.csv'),
+                 '-g', os.path.join(evaldir, 'example_groundtruth.csv'), '-o', output_file])
+
+        est = cm.read_file(os.path.join(evaldir, 'example_prediction.csv'))
+        gt = cm.read_file(os.path.join(evaldir, 'example_groundtruth.csv'))
+        with open(output_file) as fid:
+            rows = [line.rstrip('\r\n').split(',') for line in fid]
+        self.assertEqual([row[0] for row in rows], cm.get_metrics(est, gt)[1])
+        self.assertEqual([row[1] for row in rows], [str(value) for value in legacy_metrics(est, gt)])
+
+    def test_accumulator_matches_get_metrics(self):
+        accumulator = cm.MetricAccumulator()
+        for start in range(0, 200, 37):
+            accumulator.update(self.est[start:start + 37], self.gt[start:start + 37])
+        np.testing.assert_allclose(accumulator.get_metrics()[0], cm.get_metrics(self.est, self.gt)[0])
+
+    def test_accumulator_merge(self):
+        scores = np.random.RandomState(6).uniform(size=200)
+        whole = cm.MetricAccumulator().update(self.est, self.gt, scores)
+        shards = cm.MetricAccumulator().update(self.est[:80], self.gt[:80], scores[:80])
+        shards.merge(cm.MetricAccumulator().update(self.est[80:], self.gt[80:], scores[80:]))
+        np.testing.assert_array_equal(shards.cells, whole.cells)
+        np.testing.assert_array_equal(shards.hist, whole.hist)
+        self.assertAlmostEqual(whole.get_AUC(), cm.get_AUC(scores, self.gt), places=2)
+
+    def test_main_stream(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        evaldir = os.path.dirname(cm.__file__)
+        outputs = []
+        for extra in ([], ['-s', '4']):
+            outputs.append(os.path.join(tmpdir, 'metrics%d.csv' % len(outputs)))
+            cm.main(['classification_metrics.py', '-p', os.path.join(evaldir, 'example_prediction.csv'),
+                     '-g', os.path.join(evaldir, 'example_groundtruth.csv'), '-o', outputs[-1]] + extra)
+        with open(outputs[0]) as fid0, open(outputs[1]) as fid1:
+            self.assertEqual(fid0.read(), fid1.read())
+
+    def test_bootstrap_replicates(self):
+        scores = np.round(np.random.RandomState(7).uniform(size=200), 2)
+        est = (scores > 0.5).astype(int)
+        values = cm.get_bootstrap_metrics(est, self.gt, n_boot=5, seed=1, scores=scores)
+
+        idx = np.random.default_rng(np.random.SeedSequence(1).spawn(1)[0]).integers(0, 200, size=(5, 200))
+        for rep in range(5):
+            expected = cm.get_metrics_from_counts(cm.get_counts(est[idx[rep]], self.gt[idx[rep]]))[0]
+            expected.append(cm.get_AUC(scores[idx[rep]], self.gt[idx[rep]]))
+            np.testing.assert_allclose(values[rep], expected)
+
+    def test_bootstrap_reproducible(self):
+        with mock.patch.object(cm, 'BOOTSTRAP_BLOCK_SIZE', 1000):
+            serial = cm.get_bootstrap_metrics(self.est, self.gt, n_boot=20, seed=3)
+            parallel = cm.get_bootstrap_metrics(self.est, self.gt, n_boot=20, seed=3, workers=2)
+        np.testing.assert_array_equal(serial, parallel)
+        lower, upper = cm.get_bootstrap_ci(self.est, self.gt, n_boot=200, seed=3)
+        results = cm.get_metrics(self.est, self.gt)[0]
+        self.assertTrue(np.all(np.array(lower) <= np.array(results)))
+        self.assertTrue(np.all(np.array(results) <= np.array(upper)))
+
+    def test_AUC_matches_sklearn(self):
+        try:
+            import sklearn.metrics as skm
+        except ImportError:
+            self.skipTest('scikit-learn is not installed')
+        rng = np.random.RandomState(8)
+        for n in (2, 10, 1000):
+            gt = rng.randint(0, 2, n)
+            gt[:2] = (0, 1)
+            for scores in (rng.uniform(size=n), np.round(rng.uniform(size=n), 1), rng.randint(0, 2, n)):
+                fpr, tpr, thresholds = skm.roc_curve(gt, scores)
+                self.assertAlmostEqual(cm.get_AUC(scores, gt), skm.auc(fpr, tpr), places=12)
+
+    def test_AUC_single_class(self):
+        self.assertTrue(np.isnan(cm.get_AUC(np.array([0.2, 0.8]), np.array([1, 1]))))
+
+    def test_threshold_sweep(self):
+        scores = np.round(np.random.RandomState(10).uniform(size=200), 2)
+        thresholds, names, values = cm.get_threshold_sweep(scores, self.gt)
+        np.testing.assert_array_equal(thresholds, np.unique(scores)[::-1])
+        for threshold, row in zip(thresholds, values):
+            expected = cm.get_metrics_from_counts(cm.get_counts((scores >= threshold).astype(int), self.gt))[0]
+            np.testing.assert_allclose(row, expected)
+
+        threshold, value = cm.get_best_threshold(scores, self.gt, 'Accuracy')
+        self.assertEqual(value, np.nanmax(values[:, names.index('Accuracy')]))
+        self.assertEqual(value, cm.get_metrics((scores >= threshold).astype(int), self.gt)[0][8])
+        self.assertEqual(cm.get_sweep_best((thresholds, names, values), 'Accuracy'), (threshold, value))
+
+    def test_multiclass_binary_case(self):
+        labels, names, per_class, macro, micro = cm.get_multiclass_metrics(self.est, self.gt)
+        np.testing.assert_array_equal(labels, [0, 1])
+        np.testing.assert_allclose(per_class[1], cm.get_metrics_from_counts(cm.get_counts(self.est, self.gt))[0])
+
+    def test_multiclass_one_vs_rest(self):
+        rng = np.random.RandomState(11)
+        gt = rng.randint(0, 4, 300)
+        est = np.where(rng.uniform(size=300) < 0.6, gt, rng.randint(0, 4, 300))
+        labels, names, per_class, macro, micro = cm.get_multiclass_metrics(est, gt)
+        pooled = np.zeros(4)
+        for k, label in enumerate(labels):
+            counts = cm.get_counts((est == label).astype(int), (gt == label).astype(int))
+            np.testing.assert_allclose(per_class[k], cm.get_metrics_from_counts(counts)[0])
+            pooled += counts
+        np.testing.assert_allclose(macro, np.nanmean(per_class, axis=0))
+        accuracy = names.index('Accuracy')
+        pooled_metrics = cm.get_metrics_from_counts(cm.ConfusionCounts(*pooled))[0]
+        np.testing.assert_allclose(np.delete(micro, accuracy), np.delete(pooled_metrics, accuracy))
+        self.assertAlmostEqual(micro[accuracy], np.mean(est == gt))
+
+    def test_group_metrics_match_subsets(self):
+        rng = np.random.RandomState(13)
+        groups = rng.choice(['siteA', 'siteB', 'siteC'], 200)
+        scores = np.where(self.gt == 1, rng.uniform(0.3, 1, 200), rng.uniform(0, 0.7, 200)).round(1)
+        names, metric_names, values = cm.get_group_metrics(self.est, self.gt, groups, scores)
+        np.testing.assert_array_equal(names, ['siteA', 'siteB', 'siteC'])
+        self.assertEqual(metric_names[-1], 'AUC')
+        for name, row in zip(names, values):
+            subset = groups == name
+            expected = cm.get_metrics(self.est[subset], self.gt[subset])[0]
+            np.testing.assert_allclose(row[:-1], expected[:-1])
+            self.assertAlmostEqual(row[-1], cm.get_AUC(scores[subset], self.gt[subset]))
+
+    def test_group_AUC_single_class(self):
+        names, auc = cm.get_group_AUC(np.array([0.2, 0.8, 0.4, 0.6]), np.array([0, 1, 0, 0]), np.array([1, 1, 2, 2]))
+        np.testing.assert_array_equal(auc, [1., np.nan])
+
+
+class ReadFileTests(TestCase):
+    """
+    Test the bulk label reader.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, name, text, compress=False):
+        filename = os.path.join(self.tmpdir, name)
+        with (gzip.open(filename, 'wt') if compress else open(filename, 'w')) as fid:
+            fid.write(text)
+        return filename
+
+    def test_first_column(self):
+        labels = cm.read_file(self.write('labels.csv', '1,0.9\n0,0.2\n\n1,0.7\n'))
+        self.assertEqual(labels.dtype, np.int64)
+        np.testing.assert_array_equal(labels, [1, 0, 1])
+        np.testing.assert_array_equal(cm.read_file(self.write('scores.csv', '0.25\n0.5\n'), dtype=float), [0.25, 0.5])
+        self.assertEqual(cm.read_file(self.write('empty.csv', '')).size, 0)
+
+    def test_gzip(self):
+        filename = self.write('labels.csv.gz', '1\n0\n1\n' * 1000, compress=True)
+        np.testing.assert_array_equal(cm.read_file(filename), [1, 0, 1] * 1000)
+        chunks = list(cm.read_chunks(filename, 700))
+        self.assertEqual([chunk.size for chunk in chunks], [700, 700, 700, 700, 200])
+        np.testing.assert_array_equal(np.concatenate(chunks), [1, 0, 1] * 1000)
+
+    def test_validation(self):
+        filename = self.write('labels.csv', '1\n0\n2\n1\n3\n')
+        with self.assertRaisesRegex(ValueError, r'labels.csv: 2 value\(s\) outside \[0, 1\], first 2 at row 3'):
+            cm.read_file(filename, valid=cm.BINARY_LABELS)
+        with self.assertRaisesRegex(ValueError, 'labels.csv: expected 4 rows, found 5'):
+            cm.read_file(filename, n_rows=4)
+        with self.assertRaisesRegex(ValueError, 'first 2 at row 3'):
+            list(cm.read_chunks(filename, 2, valid=cm.BINARY_LABELS))
+        with self.assertRaisesRegex(ValueError, 'bad.csv: .*yes'):
+            cm.read_file(self.write('bad.csv', '1\nyes\n'))
+        with self.assertRaisesRegex(ValueError, 'outside'):
+            cm.read_file(self.write('nan.csv', '0.5\nnan\n'), dtype=float, valid=(-np.inf, np.inf))
+
+    def test_main_stream_blank_lines(self):
+        prediction = self.write('prediction.csv', '1\n0\n\n1\n1\n\n')
+        groundtruth = self.write('groundtruth.csv', '1\n0\n0\n1\n')
+        outputs = []
+        for extra in ([], ['-s', '2'], ['-s', '4']):
+            outputs.append(os.path.join(self.tmpdir, 'metrics%d.csv' % len(outputs)))
+            cm.main(['classification_metrics.py', '-p', prediction, '-g', groundtruth, '-o', outputs[-1]] + extra)
+        for output in outputs[1:]:
+            with open(outputs[0]) as fid0, open(output) as fid:
+                self.assertEqual(fid0.read(), fid.read())
+
+    def test_chunk_row_numbers(self):
+        with self.assertRaisesRegex(ValueError, 'first 2 at row 5'):
+            list(cm.read_chunks(self.write('labels.csv', '1\n\n0\n1\n2\n'), 2, cm.BINARY_LABELS))
+
+    def test_main_sweep_sorts_once(self):
+        scores = self.write('scores.csv', '0.9\n0.2\n0.6\n0.4\n')
+        groundtruth = self.write('groundtruth.csv', '1\n0\n1\n0\n')
+        with mock.patch.object(cm, 'get_threshold_counts', wraps=cm.get_threshold_counts) as counts:
+            cm.main(['classification_metrics.py', '-p', scores, '-g', groundtruth, '-t', 'Accuracy',
+                     '-o', os.path.join(self.tmpdir, 'sweep.csv')])
+        self.assertEqual(counts.call_count, 1)
+
+    def test_main_length_mismatch(self):
+        prediction = self.write('prediction.csv', '1\n0\n1\n')
+        groundtruth = self.write('groundtruth.csv', '1\n0\n')
+        with self.assertRaisesRegex(ValueError, 'prediction.csv: expected 2 rows, found 3'):
+            cm.main(['classification_metrics.py', '-p', prediction, '-g', groundtruth,
+                     '-o', os.path.join(self.tmpdir, 'metrics.csv')])
+
+    def test_main_groups(self):
+        prediction = self.write('prediction.csv', '1\n0\n1\n0\n')
+        groundtruth = self.write('groundtruth.csv', '1\n0\n0\n0\n')
+        groups = self.write('groups.csv', 'a\na\nb\nb\n')
+        output = os.path.join(self.tmpdir, 'metrics.csv')
+        cm.main(['classification_metrics.py', '-p', prediction, '-g', groundtruth, '-G', groups, '-o', output])
+        rows = np.loadtxt(output, delimiter=',', dtype=str, skiprows=1)
+        values = dict(((group, metric), value) for group, metric, value in rows)
+        self.assertEqual(sorted(set(rows[:, 0])), ['a', 'all', 'b'])
+        self.assertEqual(float(values[('a', 'Accuracy')]), 1.)
+        self.assertEqual(float(values[('b', 'Accuracy')]), 0.5)
+        self.assertEqual(float(values[('all', 'Accuracy')]), 0.75)
+
+
+class LeaderboardTests(TestCase):
+    """
+    Test scoring a directory of submissions.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.subdir = os.path.join(self.tmpdir, 'submissions')
+        os.mkdir(self.subdir)
+        rng = np.random.RandomState(17)
+        self.gt = rng.randint(0, 2, 100)
+        self.predictions = [rng.randint(0, 2, 100) for _ in range(3)] + [np.zeros(100, dtype=int)]
+        for k, est in enumerate(self.predictions):
+            np.savetxt(os.path.join(self.subdir, 'team%d.csv' % k), est, fmt='%d')
+        self.groundtruth = os.path.join(self.tmpdir, 'groundtruth.csv')
+        np.savetxt(self.groundtruth, self.gt, fmt='%d')
+
+    def test_stacked_metrics_match_get_metrics(self):
+        codes = [3 * self.gt + est for est in self.predictions]
+        values = cm.get_stacked_metrics(codes)
+        for est, row in zip(self.predictions, values):
+            np.testing.assert_allclose(row, cm.get_metrics(est, self.gt)[0])
+
+    def test_leaderboard(self):
+        with open(os.path.join(self.subdir, 'short.csv'), 'w') as fid:
+            fid.write('1\n0\n')
+        files = cm.find_submissions(self.subdir)
+        with mock.patch.object(cm, 'LEADERBOARD_BLOCK_SIZE', 250):
+            names, values, errors = cm.get_leaderboard(files, self.gt)
+        self.assertEqual([os.path.basename(f) for f in files], ['short.csv', 'team0.csv', 'team1.csv', 'team2.csv',
+                                                               'team3.csv'])
+        self.assertIn('expected 100 rows, found 2', errors[0])
+        self.assertTrue(np.all(np.isnan(values[0])))
+        for est, row, error in zip(self.predictions, values[1:], errors[1:]):
+            self.assertIsNone(error)
+            np.testing.assert_allclose(row, cm.get_metrics(est, self.gt)[0])
+
+    def test_concurrent_leaderboards(self):
+        # each leaderboard keeps its own ground truth, as when the worker service runs evaluations on threads
+        from concurrent.futures import ThreadPoolExecutor
+        files = cm.find_submissions(self.subdir)
+        truths = [self.predictions[0], self.predictions[1]] * 4
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda gt: cm.get_leaderboard(files, gt)[1], truths))
+        accuracy = cm.METRIC_NAMES.index('Accuracy')
+        for gt, values in zip(truths, results):
+            np.testing.assert_allclose(values[:, accuracy], [np.mean(est == gt) for est in self.predictions])
+
+    def test_main_leaderboard_workers(self):
+        output = os.path.join(self.tmpdir, 'leaderboard.csv')
+        cm.main(['classification_metrics.py', '-L', self.subdir, '-g', self.groundtruth, '-o', output, '-j', '2'])
+        rows = np.loadtxt(output, delimiter=',', dtype=str, skiprows=1, ndmin=2)
+        np.testing.assert_array_equal(rows[:, 0], ['team0.csv', 'team1.csv', 'team2.csv', 'team3.csv'])
+        accuracy = rows[:, 1 + cm.METRIC_NAMES.index('Accuracy')].astype(float)
+        np.testing.assert_allclose(accuracy, [np.mean(est == self.gt) for est in self.predictions])
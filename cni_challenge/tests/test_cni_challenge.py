@@ -1,7 +1,15 @@
 
+import json
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest import mock
+import numpy as np
 from cni_challenge.cni_challenge import Cni_challenge
+from cni_challenge import service
+from cni_challenge.example_python import rotate
+from cni_challenge.example_python.cohort_store import CohortStore
 
 
 class Cni_challengeTests(TestCase):
@@ -10,24 +18,210 @@ class Cni_challengeTests(TestCase):
     """
     def setUp(self):
         self.app = Cni_challenge()
+        self.inputdir = os.path.join(self.app.SELFPATH, 'inputdir')
+        self.outputdir = tempfile.mkdtemp()
 
-    def test_run(self):
-        """
-        Test the run code.
-        """
+    def tearDown(self):
+        shutil.rmtree(self.outputdir)
+
+    def run_app(self, run_option, *extra_args):
         args = []
         if self.app.TYPE == 'ds':
-            args.append('inputdir') # you may want to change this inputdir mock
-        args.append('outputdir')  # you may want to change this outputdir mock
+            args.append(self.inputdir)
+        args.append(self.outputdir)
+        args.extend(extra_args)
 
-        # you may want to add more of your custom defined optional arguments to test
-        # your app with
-        # eg.
-        # args.append('--custom-int')
-        # args.append(10)
+        args.append('--rot')
+        args.append('rotation_matrices.txt')
+        args.append('--run_option')
+        args.append(run_option)
 
         options = self.app.parse_args(args)
         self.app.run(options)
+        return options
+
+    def test_run(self):
+        """
+        Test the run code.
+        """
+        options = self.run_app('python')
+
+        self.assertEqual(options.outputdir, self.outputdir)
+        with open(os.path.join(self.outputdir, 'classification.txt')) as fid:
+            output = fid.read()
+        with open(os.path.join(self.app.SELFPATH, 'outputdir', 'classification.txt')) as fid:
+            expected = fid.read()
+        self.assertEqual(output, expected)
+
+    def test_run_C(self):
+        """
+        Test the native kernel gives the same output as the python example.
+        """
+        self.run_app('C')
+
+        with open(os.path.join(self.outputdir, 'classification.txt')) as fid:
+            output = fid.read()
+        with open(os.path.join(self.app.SELFPATH, 'outputdir', 'classification.txt')) as fid:
+            expected = fid.read()
+        self.assertEqual(output, expected)
+
+    def test_run_float32(self):
+        """
+        Test single precision agrees with the expected output to the last written decimal.
+        """
+        self.run_app('python', '--dtype', 'float32')
+
+        output = np.loadtxt(os.path.join(self.outputdir, 'classification.txt'))
+        expected = np.loadtxt(os.path.join(self.app.SELFPATH, 'outputdir', 'classification.txt'))
+        np.testing.assert_allclose(output, expected, rtol=0, atol=2e-7)
+
+    def test_run_subjects(self):
+        """
+        Test per-subject subdirectories are processed in parallel and a failing subject does not stop the batch.
+        """
+        self.inputdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.inputdir)
+        for subject in ('sub-01', 'sub-02', 'sub-03'):
+            shutil.copytree(os.path.join(self.app.SELFPATH, 'inputdir'), os.path.join(self.inputdir, subject))
+        with open(os.path.join(self.inputdir, 'sub-02', 'rotation_matrices.txt'), 'w') as fid:
+            fid.write('not a number\n')
+
+        self.run_app('python', '--workers', '2')
+
+        with open(os.path.join(self.app.SELFPATH, 'outputdir', 'classification.txt')) as fid:
+            expected = fid.read()
+        for subject in ('sub-01', 'sub-03'):
+            with open(os.path.join(self.outputdir, subject, 'classification.txt')) as fid:
+                self.assertEqual(fid.read(), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.outputdir, 'sub-02', 'classification.txt')))
+
+    def test_run_stats(self):
+        """
+        Test the per-stage statistics and the opt-in profile are written to outputdir.
+        """
+        self.run_app('python', '--profile', '--chunk_size', '10', '--threads', '2')
+
+        with open(os.path.join(self.outputdir, self.app.OUTPUT_META_DICT['runStatsFile'])) as fid:
+            stats = json.load(fid)
+        self.assertEqual(stats['rows'], 68)
+        self.assertEqual(stats['threads'], 2)
+        self.assertEqual(sorted(stats['stages']), ['compute', 'load', 'save'])
+        for record in stats['stages'].values():
+            self.assertGreaterEqual(record['wall_s'], 0)
+            self.assertIn('cpu_s', record)
+            self.assertIn('process_peak_rss_mb', record)
+            self.assertIn('peak_rss_growth_mb', record)
+            self.assertIn('rows_per_s', record)
+        self.assertTrue(os.path.exists(os.path.join(self.outputdir, 'profile.prof')))
+
+    def test_run_service(self):
+        """
+        Test jobs go to a running worker service, and run in-process when none answers.
+        """
+        socket_path = os.path.join(self.outputdir, 'service.sock')
+        worker = service.start_service(socket_path, workers=1)
+        try:
+            with mock.patch.object(service, 'op_rotate', wraps=service.op_rotate) as op_rotate:
+                with mock.patch.dict(service.OPERATIONS, {'rotate': op_rotate}):
+                    self.run_app('python', '--service_socket', socket_path)
+            self.assertEqual(op_rotate.call_count, 1)
+        finally:
+            worker.shutdown()
+            worker.server_close()
+        with open(os.path.join(self.outputdir, 'classification.txt')) as fid:
+            output = fid.read()
+        with open(os.path.join(self.app.SELFPATH, 'outputdir', 'classification.txt')) as fid:
+            expected = fid.read()
+        self.assertEqual(output, expected)
+
+        os.remove(os.path.join(self.outputdir, 'classification.txt'))
+        self.run_app('python', '--service_socket', socket_path)
+        self.assertTrue(os.path.exists(os.path.join(self.outputdir, 'classification.txt')))
+
+    def test_run_bad_output_format(self):
+        """
+        Test an unknown --output_format is rejected before anything is computed or written.
+        """
+        with self.assertRaises(SystemExit):
+            self.run_app('python', '--output_format', 'csv')
+        self.assertEqual(os.listdir(self.outputdir), [])
+
+    def test_service_paths_absolute(self):
+        """
+        Test relative path options are resolved before a job is sent to the service.
+        """
+        from cni_challenge.cni_challenge import rotate_subject_service
+        options = self.app.parse_args([self.inputdir, self.outputdir, '--rot', 'rotation_matrices.txt',
+                                       '--run_option', 'python', '--cache_dir', 'cache',
+                                       '--service_socket', 'service.sock'])
+        # cni_challenge.py imports the service as a top-level module, from its own directory
+        with mock.patch('service.request', return_value={'output': '', 'stats': {}}) as request:
+            rotate_subject_service(self.inputdir, self.outputdir, options)
+        sent = request.call_args[1]['options']
+        self.assertEqual(sent['cache_dir'], os.path.abspath('cache'))
+        self.assertEqual(sent['service_socket'], os.path.abspath('service.sock'))
+        self.assertEqual(options.cache_dir, 'cache')
+
+    def test_run_manifest(self):
+        """
+        Test a repeat run is skipped unless the inputs, options or output changed, or --force is given.
+        """
+        self.inputdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.inputdir)
+        for subject in ('sub-01', 'sub-02'):
+            shutil.copytree(os.path.join(self.app.SELFPATH, 'inputdir'), os.path.join(self.inputdir, subject))
+
+        def run(*extra_args):
+            with mock.patch('example_python.rotate.rotate_matrix', wraps=rotate.rotate_matrix) as rotate_matrix:
+                self.run_app('python', *extra_args)
+            return sorted(os.path.basename(os.path.dirname(call[0][2])) for call in rotate_matrix.call_args_list)
+
+        self.assertEqual(run(), ['sub-01', 'sub-02'])
+        with open(os.path.join(self.outputdir, 'sub-01', self.app.OUTPUT_META_DICT['manifestFile'])) as fid:
+            manifest = json.load(fid)
+        self.assertEqual(sorted(manifest['inputs']), ['rotations', 'vectors'])
+        self.assertEqual(manifest['options']['dtype'], 'float64')
+        self.assertEqual(run(), [])
+
+        with open(os.path.join(self.inputdir, 'sub-02', 'vectors.txt'), 'a') as fid:
+            fid.write('\n')    # new content, same vectors: rehashed and recomputed
+        self.assertEqual(run(), ['sub-02'])
+        self.assertEqual(run('--dtype', 'float32'), ['sub-01', 'sub-02'])
+        self.assertEqual(run('--dtype', 'float32', '--chunk_size', '10'), [])
+        os.remove(os.path.join(self.outputdir, 'sub-01', 'classification.txt'))
+        self.assertEqual(run('--dtype', 'float32'), ['sub-01'])
+        self.assertEqual(run('--dtype', 'float32', '--force'), ['sub-01', 'sub-02'])
+
+    def test_run_connectome(self):
+        """
+        Test connectome features are extracted from per-subject time series.
+        """
+        self.inputdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.inputdir)
+        rng = np.random.RandomState(2)
+        for subject in ('sub-02', 'sub-01'):
+            os.makedirs(os.path.join(self.inputdir, subject))
+            np.savetxt(os.path.join(self.inputdir, subject, 'timeseries.txt'), rng.normal(size=(50, 8)))
+
+        self.run_app('python', '--connectome', 'correlation,partial')
+
+        with open(os.path.join(self.outputdir, 'connectome_subjects.txt')) as fid:
+            self.assertEqual(fid.read().split(), ['sub-01', 'sub-02'])
+        for kind in ('correlation', 'partial'):
+            features = np.load(os.path.join(self.outputdir, 'connectome_%s.npy' % kind))
+            self.assertEqual(features.shape, (2, 28))
+            self.assertEqual(features.dtype, np.float32)
+        self.assertFalse(os.path.exists(os.path.join(self.outputdir, 'classification.txt')))
+
+        store = CohortStore(os.path.join(self.outputdir, 'cohort_timeseries'))
+        self.assertEqual(sorted(store.subjects), ['sub-01', 'sub-02'])
+        self.assertEqual(store['sub-01'].shape, (50, 8))
+
+        with self.assertRaises(SystemExit):
+            self.run_app('python', '--connectome', 'both')
 
-        # write your own assertions
-        self.assertEqual(options.outputdir, 'outputdir')
+        # outputdir is created if needed
+        self.addCleanup(shutil.rmtree, self.outputdir)
+        self.outputdir = os.path.join(self.outputdir, 'new')
+        self.run_app('python', '--connectome', 'correlation')
+        self.assertTrue(os.path.exists(os.path.join(self.outputdir, 'connectome_correlation.npy')))
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase
+from cni_challenge.example_python.cohort_store import CohortStore
+from cni_challenge.example_python import vector_io
+
+
+class CohortStoreTests(TestCase):
+    """
+    Test the memory-mapped cohort store.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'cohort')
+        rng = np.random.RandomState(12)
+        self.arrays = dict(('sub-%02d' % i, rng.normal(size=(4 if i != 2 else 6, 3))) for i in range(4))
+
+    def test_append_and_reopen(self):
+        store = CohortStore(self.path)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.append(sorted(self.arrays.items())), sorted(self.arrays))
+
+        for reopened in (store, CohortStore(self.path)):
+            self.assertEqual(reopened.subjects, sorted(self.arrays))
+            for subject, data in self.arrays.items():
+                np.testing.assert_array_equal(reopened[subject], data)
+                self.assertTrue(np.shares_memory(reopened[subject], reopened.data))
+        self.assertIn('sub-01', store)
+        self.assertNotIn('sub-09', store)
+
+    def test_append_does_not_rewrite(self):
+        store = CohortStore(self.path)
+        store.append([('sub-00', self.arrays['sub-00'])])
+        with open(store.data_file, 'rb') as fid:
+            before = fid.read()
+        store.append([('sub-01', self.arrays['sub-01']), ('sub-00', self.arrays['sub-03'])])
+        with open(store.data_file, 'rb') as fid:
+            after = fid.read()
+        self.assertEqual(after[vector_io.RAW_HEADER.size:len(before)], before[vector_io.RAW_HEADER.size:])
+        np.testing.assert_array_equal(CohortStore(self.path)['sub-00'], self.arrays['sub-03'])  # superseded
+        self.assertEqual(store.subjects, ['sub-01', 'sub-00'])
+
+    def test_stack(self):
+        store = CohortStore(self.path)
+        store.append(sorted(self.arrays.items()))
+        consecutive = store.stack(['sub-00', 'sub-01'])
+        self.assertEqual(consecutive.shape, (2, 4, 3))
+        self.assertTrue(np.shares_memory(consecutive, store.data))
+        gathered = store.stack(['sub-03', 'sub-00'])
+        np.testing.assert_array_equal(gathered, [self.arrays['sub-03'], self.arrays['sub-00']])
+        with self.assertRaises(ValueError):
+            store.stack(['sub-01', 'sub-02'])
+
+    def test_interrupted_append(self):
+        store = CohortStore(self.path)
+        store.append([('sub-00', self.arrays['sub-00'])])
+        # rows and an index line past the header's row count, as left by an append that did not finish
+        with open(store.data_file, 'ab') as fid:
+            fid.write(b'\0' * 24 * 2)
+        with open(store.index_file, 'a') as fid:
+            fid.write('sub-01\t4\t6\n')
+        store = CohortStore(self.path)
+        self.assertEqual(store.subjects, ['sub-00'])
+        store.append([('sub-01', self.arrays['sub-01'])])
+        np.testing.assert_array_equal(CohortStore(self.path)['sub-01'], self.arrays['sub-01'])
+
+    def test_update_from_files(self):
+        files = []
+        for subject in ('sub-00', 'sub-01'):
+            filename = os.path.join(self.tmpdir, subject + '.txt')
+            np.savetxt(filename, self.arrays[subject])
+            files.append((subject, filename))
+        store = CohortStore(self.path)
+        self.assertEqual(store.update_from_files(files), ['sub-00', 'sub-01'])
+        self.assertEqual(store.update_from_files(files), [])
+        np.savetxt(files[1][1], self.arrays['sub-03'][:3])
+        self.assertEqual(store.update_from_files(files), ['sub-01'])
+        np.testing.assert_allclose(store['sub-01'], self.arrays['sub-03'][:3])
+
+    def test_column_mismatch(self):
+        store = CohortStore(self.path)
+        store.append([('sub-00', self.arrays['sub-00'])])
+        with self.assertRaises(ValueError):
+            store.append([('sub-01', np.zeros((2, 5)))])
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase, mock
+from cni_challenge.example_python import connectome
+
+
+def partial_correlation_regression(series, i, j):
+    """
+    Reference partial correlation of ROIs i and j: correlate their residuals after regressing out all other ROIs.
+    """
+    others = np.column_stack([np.delete(series, [i, j], axis=1), np.ones(series.shape[0])])
+    residuals = [series[:, k] - others.dot(np.linalg.lstsq(others, series[:, k], rcond=None)[0]) for k in (i, j)]
+    return np.corrcoef(residuals)[0, 1]
+
+
+class ConnectomeTests(TestCase):
+    """
+    Test the batched connectome features.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(8)
+        self.series = rng.normal(size=(4, 120, 10))
+        self.series[:, :, 1] += self.series[:, :, 0]
+
+    def test_correlation(self):
+        corr = connectome.correlation_matrices(self.series)
+        for subject in range(4):
+            np.testing.assert_allclose(corr[subject], np.corrcoef(self.series[subject].T), atol=1e-12)
+
+    def test_constant_roi(self):
+        series = self.series.copy()
+        series[0, :, 3] = 5
+        corr = connectome.correlation_matrices(series)
+        self.assertTrue(np.all(np.isfinite(corr)))
+        np.testing.assert_array_equal(np.delete(corr[0, 3], 3), 0)
+        self.assertEqual(corr[0, 3, 3], 1)
+
+    def test_partial_correlation(self):
+        partial = connectome.partial_correlation_matrices(connectome.correlation_matrices(self.series))
+        for i, j in ((0, 1), (2, 7)):
+            self.assertAlmostEqual(partial[1, i, j], partial_correlation_regression(self.series[1], i, j))
+        np.testing.assert_allclose(partial, partial.transpose(0, 2, 1), atol=1e-12)
+
+    def test_upper_triangle(self):
+        features = connectome.connectome_features(self.series)
+        self.assertEqual(features['correlation'].shape, (4, 45))
+        self.assertEqual(features['partial'].dtype, np.float32)
+        self.assertTrue(features['partial'].flags.c_contiguous)
+        corr = np.corrcoef(self.series[2].T)
+        self.assertAlmostEqual(features['correlation'][2, 0], corr[0, 1], places=6)
+        self.assertAlmostEqual(features['correlation'][2, 9], corr[1, 2], places=6)
+
+
+class ExtractFeaturesTests(TestCase):
+    """
+    Test feature extraction from files with the per-subject cache.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        rng = np.random.RandomState(3)
+        self.files = []
+        for subject, nTimepoints in enumerate((100, 80, 100)):
+            filename = os.path.join(self.tmpdir, 'sub-%02d.txt' % subject)
+            np.savetxt(filename, rng.normal(size=(nTimepoints, 6)))
+            self.files.append(filename)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def extract(self, files):
+        with mock.patch.object(connectome, 'connectome_features', wraps=connectome.connectome_features) as compute:
+            features = connectome.extract_features(files, cache_dir=self.cache_dir)
+        return features, sum(len(call[0][0]) for call in compute.call_args_list)
+
+    def test_matches_direct(self):
+        features, computed = self.extract(self.files)
+        self.assertEqual(computed, 3)
+        for index, filename in enumerate(self.files):
+            expected = connectome.connectome_features(np.loadtxt(filename)[np.newaxis])
+            np.testing.assert_array_equal(features['partial'][index], expected['partial'][0])
+        self.assertEqual(features['correlation'].shape, (3, 15))
+
+    def test_cache(self):
+        first, computed = self.extract(self.files[:2])
+        again, computed = self.extract(self.files)
+        self.assertEqual(computed, 1)    # only the new subject
+        np.testing.assert_array_equal(again['correlation'][:2], first['correlation'])
+
+        np.savetxt(self.files[0], np.random.RandomState(4).normal(size=(90, 6)))
+        changed, computed = self.extract(self.files)
+        self.assertEqual(computed, 1)
+        self.assertFalse(np.array_equal(changed['correlation'][0], again['correlation'][0]))
+
+    def test_errors(self):
+        np.savetxt(self.files[1], np.zeros((80, 5)))
+        with self.assertRaises(ValueError):
+            connectome.extract_features(self.files)
+        with self.assertRaises(ValueError):
+            connectome.extract_features(self.files, kinds=['covariance'])
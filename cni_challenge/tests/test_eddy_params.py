@@ -0,0 +1,49 @@
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase
+from unittest import mock
+from cni_challenge.example_python import eddy_params
+
+
+class EddyParamsTests(TestCase):
+    """
+    Test the column-selective rotation parser and its on-disk cache.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.params = np.random.RandomState(3).uniform(-0.1, 0.1, (40, 16))
+        self.param_file = os.path.join(self.tmpdir, 'rotation_matrices.txt')
+        np.savetxt(self.param_file, self.params)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_matches_loadtxt(self):
+        np.testing.assert_array_equal(eddy_params.parse_rotations(self.param_file),
+                                      np.loadtxt(self.param_file)[:, 3:6])
+
+    def test_parse_short_row(self):
+        with self.assertRaises(ValueError):
+            eddy_params.parse_rotations(['1 2 3 4 5\n'])
+
+    def test_cache_skips_parsing(self):
+        cache = eddy_params.RotationCache(self.cache_dir)
+        first = eddy_params.load_rotations(self.param_file, cache)
+        with mock.patch.object(eddy_params, 'parse_rotations', side_effect=AssertionError('parsed again')):
+            second = eddy_params.load_rotations(self.param_file, cache)
+        np.testing.assert_array_equal(first, second)
+
+    def test_cache_invalidated_by_change(self):
+        cache = eddy_params.RotationCache(self.cache_dir)
+        eddy_params.load_rotations(self.param_file, cache)
+        np.savetxt(self.param_file, self.params[:10])
+        self.assertEqual(eddy_params.load_rotations(self.param_file, cache).shape, (10, 3))
+
+    def test_eviction(self):
+        cache = eddy_params.RotationCache(self.cache_dir, max_bytes=1)
+        eddy_params.load_rotations(self.param_file, cache)
+        self.assertEqual(os.listdir(self.cache_dir), [])
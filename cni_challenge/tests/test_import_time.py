@@ -0,0 +1,44 @@
+
+import os
+import subprocess
+import sys
+import time
+from unittest import TestCase
+
+SELFPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall-clock budget in seconds for a metadata command (best of a few runs), overridable for slow CI hosts
+IMPORT_TIME_BUDGET = float(os.environ.get('CNI_IMPORT_TIME_BUDGET', '1.0'))
+
+# Modules that metadata commands must not pay for
+HEAVY_MODULES = ('numpy', 'sklearn', 'scipy', 'pdb', 'multiprocessing')
+
+
+def loaded_modules(script):
+    """
+    Return the HEAVY_MODULES loaded after running script in a fresh interpreter.
+    """
+    code = '%s\nimport sys\nprint(" ".join(m for m in %r if m in sys.modules))' % (script, HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=SELFPATH)
+    return output.decode().split()
+
+
+class ImportTimeTests(TestCase):
+    """
+    Check the plugin entry points start without heavy numeric imports.
+    """
+    def test_plugin_import_is_light(self):
+        self.assertEqual(loaded_modules('import cni_challenge'), [])
+
+    def test_metrics_import_is_light(self):
+        self.assertEqual(loaded_modules('import sys; sys.path.insert(0, "evaluation")\n'
+                                        'import classification_metrics'), ['numpy'])
+
+    def test_version_within_budget(self):
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            subprocess.check_output([sys.executable, os.path.join(SELFPATH, 'cni_challenge.py'), '--version'])
+            best = min(best, time.perf_counter() - start)
+        self.assertLess(best, IMPORT_TIME_BUDGET,
+                        '--version took %.3f s, budget is %.3f s' % (best, IMPORT_TIME_BUDGET))
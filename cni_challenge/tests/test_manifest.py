@@ -0,0 +1,80 @@
+
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from cni_challenge import manifest
+
+
+class ManifestTests(TestCase):
+    """
+    Test run manifests.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.input = os.path.join(self.tmpdir, 'vectors.txt')
+        self.output = os.path.join(self.tmpdir, 'classification.txt')
+        self.filename = os.path.join(self.tmpdir, 'manifest.json')
+        self.write(self.input, b'1\t0\t0\n' * 1000)
+        self.write(self.output, b'out\n')
+
+    def write(self, filename, data):
+        with open(filename, 'wb') as fid:
+            fid.write(data)
+
+    def make(self, **options):
+        return manifest.Manifest(self.filename, {'vectors': self.input}, options or {'dtype': 'float64'}, '0.1+abc')
+
+    def test_file_digest(self):
+        modified = os.stat(self.input).st_mtime_ns - 10 * manifest.RACY_NS
+        os.utime(self.input, ns=(modified, modified))
+        with mock.patch.object(manifest, 'HASH_BLOCK_SIZE', 100):
+            digest = manifest.file_digest(self.input)
+        self.assertEqual(digest['sha256'], hashlib.sha256(b'1\t0\t0\n' * 1000).hexdigest())
+        self.assertEqual(digest['size'], 6000)
+
+        # an unchanged size and modification time reuses the previous hash without reading the file
+        with mock.patch('builtins.open', side_effect=AssertionError):
+            self.assertIs(manifest.file_digest(self.input, digest), digest)
+
+        # but not if the file was modified too soon before it was hashed to tell a later change apart
+        os.utime(self.input, ns=(digest['hashed_ns'], digest['hashed_ns']))
+        racy = dict(digest, mtime_ns=digest['hashed_ns'])
+        self.assertIsNot(manifest.file_digest(self.input, racy), racy)
+
+    def test_up_to_date(self):
+        outputs = {'classification': self.output}
+        self.assertFalse(self.make().up_to_date(outputs))
+        self.make().save(outputs)
+        self.assertTrue(self.make().up_to_date(outputs))
+        self.assertFalse(self.make(dtype='float32').up_to_date(outputs))
+        self.assertFalse(manifest.Manifest(self.filename, {'vectors': self.input}, {'dtype': 'float64'},
+                                           '0.2+abc').up_to_date(outputs))
+
+        self.write(self.output, b'edited\n')
+        self.assertFalse(self.make().up_to_date(outputs))
+        self.make().save(outputs)
+        self.write(self.input, b'0\t1\t0\n' * 1000)
+        self.assertFalse(self.make().up_to_date(outputs))
+
+    def test_outputs_not_hashed(self):
+        outputs = {'classification': self.output}
+        self.make().save(outputs)
+        self.assertEqual(sorted(manifest.read_manifest(self.filename)['outputs']['classification']),
+                         ['mtime_ns', 'size'])
+
+    def test_inputs_hashed_on_demand(self):
+        with mock.patch.object(manifest, 'file_digest', wraps=manifest.file_digest) as digest:
+            record = self.make()
+            self.assertEqual(digest.call_count, 0)
+            record.save({'classification': self.output})
+        self.assertEqual([call[0][0] for call in digest.call_args_list], [self.input])
+
+    def test_invalidate(self):
+        self.make().save({'classification': self.output})
+        self.make().invalidate()
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertIsNone(manifest.read_manifest(self.filename))
@@ -0,0 +1,227 @@
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase, mock
+from cni_challenge.example_python import rotate
+from cni_challenge.example_python.rotate import rotation_coefficients, rotate_vectors, rotate_matrix, unique_rotations
+
+
+def rotate_vectors_loop(rots, bvecs):
+    """
+    Reference per-direction implementation: build, invert and apply one matrix per row.
+    """
+    rotBvec = np.zeros(bvecs.shape)
+    for i in range(bvecs.shape[0]):
+        rotationMats = np.zeros((3, 3, 3))
+        for axis in range(3):
+            rotationMats[0, 0, axis] = np.cos(rots[i, axis])
+            rotationMats[0, 1, axis] = np.sin(rots[i, axis])
+            rotationMats[1, 0, axis] = -np.sin(rots[i, axis])
+            rotationMats[1, 1, axis] = np.cos(rots[i, axis])
+            rotationMats[2, 2, axis] = 1
+        mat = rotationMats[:, :, 0] * rotationMats[:, :, 1] * rotationMats[:, :, 2]
+        rotBvec[i, :] = np.dot(np.linalg.inv(mat), bvecs[i, :])
+    return rotBvec
+
+
+class RotateTests(TestCase):
+    """
+    Test the vectorized rotation engine.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.rots = rng.uniform(-np.pi / 3, np.pi / 3, (500, 3))
+        self.bvecs = rng.normal(size=(500, 3))
+
+    def test_rotation_coefficients(self):
+        # the element-wise product of the per-axis matrices is [[a, b, 0], [-b, a, 0], [0, 0, 1]]
+        cosRot, sinRot = np.cos(self.rots), np.sin(self.rots)
+        a, b = rotation_coefficients(self.rots)
+        np.testing.assert_allclose(a, np.prod(cosRot, axis=1), rtol=1e-14)
+        np.testing.assert_allclose(b, np.prod(sinRot, axis=1), rtol=1e-14)
+
+    def test_matches_loop(self):
+        np.testing.assert_allclose(rotate_vectors(self.rots, self.bvecs),
+                                   rotate_vectors_loop(self.rots, self.bvecs), rtol=1e-12, atol=1e-12)
+
+
+
+class RotateFloat32Tests(TestCase):
+    """
+    Test single precision and caller-provided output buffers.
+
+    float32 keeps 24 significant bits, so for unit vectors and eddy-sized rotations the result agrees with the
+    float64 path to a few 1e-7 (measured ~2e-7), i.e. the 7th decimal written to classification.txt can differ
+    by one. For large rotations the error stays within ~1e-6 relative to the output magnitude.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(6)
+        self.bvecs = rng.normal(size=(2000, 3))
+        self.bvecs /= np.linalg.norm(self.bvecs, axis=1)[:, np.newaxis]
+        self.eddy_rots = rng.uniform(-0.05, 0.05, (2000, 3))
+        self.large_rots = rng.uniform(-np.pi / 3, np.pi / 3, (2000, 3))
+
+    def rotate32(self, rots):
+        out = np.empty(self.bvecs.shape, dtype=np.float32)
+        self.assertIs(rotate_vectors(rots, self.bvecs.astype(np.float32), out=out), out)
+        return out
+
+    def test_accuracy(self):
+        error = np.abs(self.rotate32(self.eddy_rots) - rotate_vectors(self.eddy_rots, self.bvecs))
+        self.assertLess(error.max(), 5e-7)
+
+        expected = rotate_vectors(self.large_rots, self.bvecs)
+        error = np.abs(self.rotate32(self.large_rots) - expected)
+        self.assertLess(error.max(), 1e-6 * np.abs(expected).max())
+
+    def test_float32_inputs_stay_float32(self):
+        out = rotate_vectors(self.large_rots.astype(np.float32), self.bvecs.astype(np.float32))
+        self.assertEqual(out.dtype, np.float32)
+
+    def test_in_place(self):
+        expected = rotate_vectors(self.large_rots, self.bvecs)
+        bvecs = self.bvecs.copy()
+        self.assertIs(rotate_vectors(self.large_rots, bvecs, out=bvecs), bvecs)
+        np.testing.assert_array_equal(bvecs, expected)
+
+    def test_bad_out(self):
+        with self.assertRaises(ValueError):
+            rotate_vectors(self.large_rots, self.bvecs, out=np.empty((10, 3)))
+        with self.assertRaises(ValueError):
+            rotate_vectors(self.large_rots[1:], self.bvecs[1:], out=self.bvecs[:-1])
+
+
+class RotateParallelTests(TestCase):
+    """
+    Test thread-parallel rotation gives exactly the serial result.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.rots = rng.uniform(-0.1, 0.1, (1001, 3))
+        self.bvecs = rng.normal(size=(1001, 3))
+        patcher = mock.patch.object(rotate, 'MIN_PARALLEL_ROWS', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_matches_serial(self):
+        expected = rotate_vectors(self.rots, self.bvecs)
+        for workers in (1, 2, 3, 8):
+            np.testing.assert_array_equal(rotate.rotate_vectors_parallel(self.rots, self.bvecs, workers=workers), expected)
+
+    def test_in_place(self):
+        expected = rotate_vectors(self.rots, self.bvecs)
+        bvecs = self.bvecs.copy()
+        self.assertIs(rotate.rotate_vectors_parallel(self.rots, bvecs, out=bvecs, workers=4), bvecs)
+        np.testing.assert_array_equal(bvecs, expected)
+
+    def test_blocks_cover_rows(self):
+        calls = []
+        def kernel(rots, bvecs, out=None):
+            calls.append(len(rots))
+            return rotate_vectors(rots, bvecs, out=out)
+        rotate.rotate_vectors_parallel(self.rots, self.bvecs, workers=4, kernel=kernel)
+        self.assertEqual(sorted(calls), [248, 251, 251, 251])
+
+    def test_default_workers(self):
+        self.assertGreaterEqual(rotate.default_workers(), 1)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        cpu_max = os.path.join(tmpdir, 'cpu.max')
+        with mock.patch.object(rotate, 'CGROUP_CPU_MAX', cpu_max):
+            with open(cpu_max, 'w') as fid:
+                fid.write('150000 100000\n')
+            self.assertEqual(rotate.cgroup_cpu_limit(), 1.5)
+            self.assertLessEqual(rotate.default_workers(), 2)
+            with open(cpu_max, 'w') as fid:
+                fid.write('max 100000\n')
+            self.assertIsNone(rotate.cgroup_cpu_limit())
+
+
+class RotateMatrixChunkedTests(TestCase):
+    """
+    Test the streaming mode of rotate_matrix.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(1)
+        self.rot_file = os.path.join(self.tmpdir, 'rotation_matrices.txt')
+        self.vec_file = os.path.join(self.tmpdir, 'vectors.txt')
+        np.savetxt(self.rot_file, rng.uniform(-0.1, 0.1, (103, 16)))
+        np.savetxt(self.vec_file, rng.normal(size=(103, 3)), fmt='%0.7f', delimiter='\t')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, name):
+        with open(os.path.join(self.tmpdir, name)) as fid:
+            return fid.read()
+
+    def test_chunked_matches_whole(self):
+        rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'whole.txt'))
+        for chunk_size in (1, 10, 103, 1000):
+            rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'chunked.txt'),
+                          chunk_size=chunk_size)
+            self.assertEqual(self.read('chunked.txt'), self.read('whole.txt'))
+
+    def test_threads(self):
+        rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'whole.txt'))
+        with mock.patch.object(rotate, 'MIN_PARALLEL_ROWS', 4):
+            for chunk_size in (0, 10):
+                rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'threaded.txt'),
+                              chunk_size=chunk_size, threads=3)
+                self.assertEqual(self.read('threaded.txt'), self.read('whole.txt'))
+
+    def test_threads_small_input_has_no_pool(self):
+        with mock.patch.object(rotate, 'ThreadPoolExecutor') as pool:
+            rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'threaded.txt'), threads=4)
+        self.assertEqual(pool.call_count, 0)
+
+    def test_float32(self):
+        whole = os.path.join(self.tmpdir, 'whole.npy')
+        chunked = os.path.join(self.tmpdir, 'chunked.npy')
+        rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'double.npy'), out_format='npy')
+        rotate_matrix(self.rot_file, self.vec_file, whole, out_format='npy', dtype=np.float32)
+        rotate_matrix(self.rot_file, self.vec_file, chunked, chunk_size=10, out_format='npy', dtype=np.float32)
+        self.assertEqual(np.load(whole).dtype, np.float32)
+        np.testing.assert_array_equal(np.load(chunked), np.load(whole))
+        np.testing.assert_allclose(np.load(whole), np.load(os.path.join(self.tmpdir, 'double.npy')), rtol=1e-6, atol=1e-6)
+
+    def test_row_mismatch(self):
+        with open(self.vec_file, 'a') as fid:
+            fid.write('1\t0\t0\n')
+        with self.assertRaises(ValueError):
+            rotate_matrix(self.rot_file, self.vec_file, os.path.join(self.tmpdir, 'out.txt'), chunk_size=10)
+
+
+class RotateDeduplicationTests(TestCase):
+    """
+    Test repeated and zero rotations are handled once and exactly.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(9)
+        distinct = rng.uniform(-0.1, 0.1, (5, 3))
+        distinct[0] = 0
+        self.states = np.array([0, 1, 1, 2, 0, 3, 4, 4, 0])
+        self.rots = np.repeat(distinct[self.states], 40, axis=0)
+        self.bvecs = rng.normal(size=(360, 3))
+
+    def test_unique_rotations(self):
+        uniqueRots, inverse = unique_rotations(self.rots)
+        self.assertEqual(uniqueRots.shape, (7, 3))  # one per run of identical consecutive rows
+        np.testing.assert_array_equal(uniqueRots[inverse], self.rots)
+
+    def test_matches_loop(self):
+        np.testing.assert_allclose(rotate_vectors(self.rots, self.bvecs),
+                                   rotate_vectors_loop(self.rots, self.bvecs), rtol=1e-12, atol=1e-12)
+
+    def test_zero_rotation_untouched(self):
+        zero = np.all(self.rots == 0, axis=1)
+        np.testing.assert_array_equal(rotate_vectors(self.rots, self.bvecs)[zero], self.bvecs[zero])
+
+    def test_shipped_inputs(self):
+        rots = np.loadtxt(os.path.join(os.path.dirname(__file__), '..', 'inputdir', 'rotation_matrices.txt'))[:, 3:6]
+        bvecs = np.loadtxt(os.path.join(os.path.dirname(__file__), '..', 'inputdir', 'vectors.txt'))
+        self.assertLess(unique_rotations(rots)[0].shape[0], rots.shape[0])
+        np.testing.assert_allclose(rotate_vectors(rots, bvecs), rotate_vectors_loop(rots, bvecs), rtol=1e-12, atol=1e-12)
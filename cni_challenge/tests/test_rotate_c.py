@@ -0,0 +1,94 @@
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase, SkipTest, mock
+from cni_challenge.example_C import rotate as rotate_c
+from cni_challenge.example_python.rotate import rotate_vectors
+
+
+class RotateCTests(TestCase):
+    """
+    Test the native batch kernel against the NumPy engine.
+    """
+    @classmethod
+    def setUpClass(cls):
+        try:
+            rotate_c.load_library()
+        except OSError as e:
+            raise SkipTest(str(e))
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.params = rng.uniform(-np.pi / 3, np.pi / 3, (300, 16))
+        self.bvecs = rng.normal(size=(300, 3))
+
+    def test_float64_matches_numpy(self):
+        rots = self.params[:, 3:6]  # strided view, read in place
+        np.testing.assert_allclose(rotate_c.rotate_vectors(rots, self.bvecs),
+                                   rotate_vectors(rots, self.bvecs), rtol=1e-12, atol=1e-12)
+
+    def test_float32(self):
+        rots = self.params[:, 3:6].astype(np.float32)
+        out = rotate_c.rotate_vectors(rots, self.bvecs.astype(np.float32))
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_allclose(out, rotate_vectors(self.params[:, 3:6], self.bvecs), rtol=1e-4, atol=1e-5)
+
+    def test_out_buffer(self):
+        rots = self.params[:, 3:6]
+        bvecs = self.bvecs.astype(np.float32)
+        expected = rotate_c.rotate_vectors(rots.astype(np.float32), bvecs)
+        self.assertIs(rotate_c.rotate_vectors(rots, bvecs, out=bvecs), bvecs)  # in place, in single precision
+        np.testing.assert_array_equal(bvecs, expected)
+        with self.assertRaises(ValueError):
+            rotate_c.rotate_vectors(rots, self.bvecs, out=np.empty((300, 3), dtype=np.float16))
+
+    def test_row_mismatch(self):
+        with self.assertRaises(ValueError):
+            rotate_c.rotate_vectors(self.params[:10, 3:6], self.bvecs)
+
+
+class BuildLibraryTests(TestCase):
+    """
+    Test the library is rebuilt when rotate.cpp changes.
+    """
+    def setUp(self):
+        self.libdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.libdir)
+        self.libpath = os.path.join(self.libdir, rotate_c.LIBNAME)
+        for name in (rotate_c.LIBNAME, rotate_c.SOURCENAME):
+            open(os.path.join(self.libdir, name), 'w').close()
+
+    def load(self):
+        with mock.patch.object(rotate_c, 'LIBDIR', self.libdir), mock.patch.object(rotate_c, '_lib', None), \
+                mock.patch.object(rotate_c, 'build_library') as build, mock.patch('ctypes.CDLL'):
+            rotate_c.load_library()
+        return build.call_count
+
+    def test_up_to_date(self):
+        os.utime(os.path.join(self.libdir, rotate_c.SOURCENAME), (1000, 1000))
+        self.assertEqual(self.load(), 0)
+
+    def test_rebuilds_when_source_is_newer(self):
+        os.utime(self.libpath, (1000, 1000))
+        self.assertEqual(self.load(), 1)
+
+    def test_loaded_once_by_concurrent_callers(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with mock.patch.object(rotate_c, '_lib', None), mock.patch.object(rotate_c, 'open_library') as open_library:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda _: rotate_c.load_library(), range(8)))
+        self.assertEqual(open_library.call_count, 1)
+
+    def test_build_replaces_library(self):
+        srcdir = rotate_c.LIBDIR
+        for name in (rotate_c.SOURCENAME, 'Makefile'):
+            shutil.copy(os.path.join(srcdir, name), self.libdir)
+        with mock.patch.object(rotate_c, 'LIBDIR', self.libdir):
+            try:
+                rotate_c.build_library()
+            except OSError as e:
+                raise SkipTest(str(e))
+        self.assertGreater(os.path.getsize(self.libpath), 0)
+        self.assertEqual(sorted(os.listdir(self.libdir)), sorted([rotate_c.LIBNAME, rotate_c.SOURCENAME, 'Makefile']))
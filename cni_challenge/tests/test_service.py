@@ -0,0 +1,53 @@
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cni_challenge import service
+
+
+class ServiceTests(TestCase):
+    """
+    Test the worker service and its client over a Unix domain socket.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.socket_path = os.path.join(self.tmpdir, 'service.sock')
+        self.service = service.start_service(self.socket_path, workers=2)
+        self.addCleanup(self.service.server_close)
+        self.addCleanup(self.service.shutdown)
+
+    def test_available(self):
+        self.assertTrue(service.is_available(self.socket_path))
+        self.assertEqual(service.request(self.socket_path, 'ping')['pid'], os.getpid())
+        self.assertFalse(service.is_available(os.path.join(self.tmpdir, 'missing.sock')))
+
+    def test_evaluate(self):
+        prediction = os.path.join(self.tmpdir, 'prediction.csv')
+        groundtruth = os.path.join(self.tmpdir, 'groundtruth.csv')
+        output = os.path.join(self.tmpdir, 'metrics.csv')
+        np.savetxt(prediction, [1, 0, 1, 1, 0], fmt='%d')
+        np.savetxt(groundtruth, [1, 0, 0, 1, 1], fmt='%d')
+
+        result = service.request(self.socket_path, 'evaluate', prediction=prediction, groundtruth=groundtruth,
+                                 output=output)
+        self.assertEqual(result['output'], output)
+        with open(output) as fid:
+            self.assertIn('Accuracy,0.6', fid.read())
+
+    def test_errors(self):
+        with self.assertRaisesRegex(service.ServiceError, 'unknown'):
+            service.request(self.socket_path, 'unknown')
+        with self.assertRaises(service.ServiceError):
+            service.request(self.socket_path, 'evaluate', prediction='missing.csv',
+                            groundtruth='missing.csv', output=os.path.join(self.tmpdir, 'out.csv'))
+        # the service keeps serving after failed jobs
+        self.assertTrue(service.is_available(self.socket_path))
+
+    def test_socket_in_use(self):
+        with self.assertRaises(OSError):
+            service.WorkerService(self.socket_path)
@@ -0,0 +1,58 @@
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from unittest import TestCase
+from cni_challenge.example_python import vector_io
+from cni_challenge.example_python.rotate import rotate_matrix
+
+
+class VectorIOTests(TestCase):
+    """
+    Test the text, npy and raw array formats.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(2)
+        self.rots = rng.uniform(-0.1, 0.1, (57, 16))
+        self.bvecs = rng.normal(size=(57, 3))
+        self.files = {}
+        for fmt in vector_io.FORMATS:
+            self.files[fmt] = (os.path.join(self.tmpdir, 'rot' + vector_io.EXTENSIONS[fmt]),
+                               os.path.join(self.tmpdir, 'vec' + vector_io.EXTENSIONS[fmt]))
+            vector_io.save_array(self.files[fmt][0], self.rots, fmt)
+            vector_io.save_array(self.files[fmt][1], self.bvecs, fmt)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_detect_format(self):
+        for fmt in vector_io.FORMATS:
+            self.assertEqual(vector_io.detect_format(self.files[fmt][0]), fmt)
+
+    def test_binary_roundtrip_is_memmapped(self):
+        for fmt in ('npy', 'raw'):
+            data = vector_io.load_array(self.files[fmt][1])
+            self.assertIsInstance(data, np.memmap)
+            np.testing.assert_array_equal(data, self.bvecs)
+
+    def test_rotate_matrix_formats_agree(self):
+        rotate_matrix(self.files['text'][0], self.files['text'][1], os.path.join(self.tmpdir, 'ref.npy'),
+                      out_format='npy')
+        expected = np.load(os.path.join(self.tmpdir, 'ref.npy'))
+        for fmt in vector_io.FORMATS:
+            for chunk_size in (0, 10):
+                out = os.path.join(self.tmpdir, 'out' + vector_io.EXTENSIONS[fmt])
+                rotate_matrix(self.files[fmt][0], self.files[fmt][1], out, chunk_size=chunk_size, out_format=fmt)
+                np.testing.assert_allclose(vector_io.load_array(out), expected, rtol=1e-6, atol=1e-7)
+
+    def test_array_cache(self):
+        cache = vector_io.ArrayCache(os.path.join(self.tmpdir, 'cache'))
+        source = self.files['text'][1]
+        self.assertIsNone(cache.get(source))
+        features = np.arange(6, dtype=np.float32).reshape(2, 3)
+        cache.put(source, features)
+        cached = cache.get(source)
+        self.assertEqual(cached.dtype, np.float32)
+        np.testing.assert_array_equal(cached, features)